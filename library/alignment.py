@@ -0,0 +1,171 @@
+import glob
+import json
+import os
+
+import h5py
+import numpy as np
+
+from index_cache import load_index
+from matching import nearest
+
+ALIGNMENT_DIR = '../cache/alignment/'
+INDEX_PATH = '../sonyc/indices/{year}/{node}_recording_index.h5'
+
+# source -> (path of a node's store, which may be a glob pattern, dataset inside it)
+stores = {
+    'spl': (INDEX_PATH, 'recording_index'),
+    'coarse': ('../sonyc/class_predictions/1.0.0/{year}/{node}_class_predictions.h5', 'coarse'),
+    'fine': ('../sonyc/class_predictions/1.0.0/{year}/{node}_class_predictions.h5', 'fine'),
+    'openl3': ('../sonyc/features/openl3/{year}/{node}_*.h5', 'openl3'),
+}
+
+
+def store_path(source, node, year=2017):
+    '''Path of a node's store for source, or None if there is none.'''
+    pattern = stores[source][0].format(node=node, year=year)
+    if not glob.has_magic(pattern):
+        return pattern if os.path.exists(pattern) else None
+    paths = sorted(glob.glob(pattern))
+    return paths[0] if paths else None
+
+def match_rows(store_timestamps, timestamps):
+    '''Return the row in store_timestamps equal to each timestamp, or -1.
+
+    Duplicate store timestamps resolve to the first row, like the
+    `.index[0]` equality scan this replaces.
+    '''
+    if len(store_timestamps) == 0:
+        return np.full(len(timestamps), -1)
+
+    order = np.argsort(store_timestamps, kind='stable')
+    sorted_timestamps = store_timestamps[order]
+
+    position = np.searchsorted(sorted_timestamps, timestamps, side='left')
+    position = np.minimum(position, len(sorted_timestamps) - 1)
+    found = sorted_timestamps[position] == timestamps
+
+    return np.where(found, order[position], -1)
+
+def signature(path):
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class Alignment:
+    '''Row offsets of every recording of a node in each feature store.
+
+    The table is keyed on the sorted, unique timestamps of the node's
+    recording index and has one int64 column per source holding the row of
+    that recording in the source's dataset, or -1. Columns are built the
+    first time a source is used and kept in cache_dir as .npy files, so
+    later joins are a binary search over the index and a gather instead of
+    a scan over the store. A column is rebuilt when its store (or the
+    recording index) changes on disk.
+    '''
+    def __init__(self, node, year=2017, cache_dir=ALIGNMENT_DIR):
+        self.node = node
+        self.year = year
+        self.index_path = INDEX_PATH.format(year=year, node=node)
+        self.path = os.path.join(cache_dir, str(year), node)
+        os.makedirs(self.path, exist_ok=True)
+
+        self.meta = self._load_meta()
+        if self.meta.get('index') != signature(self.index_path):
+            index = load_index(self.index_path)
+            self._save_column('timestamp', np.unique(index['timestamp']))
+            self.meta = {'index': signature(self.index_path), 'sources': {}}
+            self._save_meta()
+
+        self.timestamps = np.load(os.path.join(self.path, 'timestamp.npy'), mmap_mode='r')
+        self._columns = {}
+
+    def column(self, source):
+        '''Return the row offset of every recording in source, building it if needed.'''
+        if source in self._columns:
+            return self._columns[source]
+
+        path = store_path(source, self.node, self.year)
+        if self.meta['sources'].get(source) != signature(path) or not os.path.exists(self._column_path(source)):
+            if path is None:
+                rows = np.full(len(self.timestamps), -1, dtype=np.int64)
+            else:
+                with h5py.File(path, 'r') as f:
+                    store_timestamps = f[stores[source][1]].fields('timestamp')[:]
+                rows = match_rows(store_timestamps, np.asarray(self.timestamps)).astype(np.int64)
+
+            self._save_column(source, rows)
+            self.meta['sources'][source] = signature(path)
+            self._save_meta()
+
+        self._columns[source] = np.load(self._column_path(source), mmap_mode='r')
+        return self._columns[source]
+
+    def positions(self, timestamps, tolerance=None):
+        '''Position in self.timestamps of each timestamp, or -1.
+
+        With a tolerance (in seconds) the closest recording within it is
+        used, otherwise only exact matches count.
+        '''
+        timestamps = np.asarray(timestamps)
+        if not len(self.timestamps):
+            return np.full(len(timestamps), -1)
+
+        if tolerance is None:
+            position = np.minimum(np.searchsorted(self.timestamps, timestamps), len(self.timestamps) - 1)
+            found = self.timestamps[position] == timestamps
+        else:
+            position, diff = nearest(np.arange(len(self.timestamps)), self.timestamps, timestamps)
+            found = np.abs(diff) <= tolerance
+
+        return np.where(found, position, -1)
+
+    def rows(self, source, timestamps, tolerance=None):
+        '''Row in source for each timestamp, or -1 if it has none.'''
+        position = self.positions(timestamps, tolerance)
+        rows = np.asarray(self.column(source))[np.maximum(position, 0)]
+        return np.where(position >= 0, rows, -1)
+
+    def table(self, sources=None):
+        '''The alignment as {column: array}, with the timestamp column first.'''
+        sources = list(stores) if sources is None else sources
+        table = {'timestamp': np.asarray(self.timestamps)}
+        for source in sources:
+            table[source] = np.asarray(self.column(source))
+        return table
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f'{name}.npy')
+
+    def _save_column(self, name, values):
+        tmp_path = os.path.join(self.path, f'.{name}.{os.getpid()}.npy')
+        np.save(tmp_path, values)
+        os.replace(tmp_path, self._column_path(name))
+
+    def _load_meta(self):
+        try:
+            with open(os.path.join(self.path, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_meta(self):
+        meta_path = os.path.join(self.path, 'meta.json')
+        tmp_path = meta_path + f'.{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, meta_path)
+
+
+def join(df, source, year=2017, tolerance=None, cache_dir=ALIGNMENT_DIR):
+    '''Row in source for every (node, node_timestamp) row of df, or -1.
+
+    Returns an int64 array in the order of df.
+    '''
+    rows = np.full(len(df), -1, dtype=np.int64)
+    timestamps = df['node_timestamp'].to_numpy()
+    for node, positions in df.groupby('node', sort=True).indices.items():
+        alignment = Alignment(node, year, cache_dir)
+        rows[positions] = alignment.rows(source, timestamps[positions], tolerance)
+    return rows
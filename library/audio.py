@@ -0,0 +1,36 @@
+import base64
+
+import numpy as np
+
+
+def group_by_archive(index, indices):
+    '''Return {archive path: recording indices ordered by position in the archive}.'''
+    indices = np.asarray(indices, dtype=np.int64)
+    paths = index['day_hdf5_path'][indices]
+    keys = index['day_h5_index'][indices]
+
+    order = np.lexsort((keys, paths))
+    paths, indices = paths[order], indices[order]
+
+    groups = {}
+    bounds = np.flatnonzero(paths[1:] != paths[:-1]) + 1
+    for group in np.split(np.arange(len(indices)), bounds):
+        if len(group):
+            groups[paths[group[0]].decode('utf-8')] = indices[group]
+    return groups
+
+def read_archive(path, keys, reader):
+    '''Yield the decoded audio for each key of one archive, read with `reader` (readEncryptedTarAudioFile).'''
+    for key in keys:
+        yield base64.decodebytes(reader(path, key))
+
+def iter_audio(index, indices, reader, root='../sonyc/'):
+    '''Yield (recording index, audio bytes) for indices, grouped by archive.
+
+    `index` is a node's recording index (h5 dataset or cached columns).
+    Recordings come back in archive order, not in the order requested, so
+    the files of one archive are read one after another.
+    '''
+    for path, group in group_by_archive(index, indices).items():
+        keys = index['day_h5_index'][group]
+        yield from zip(group, read_archive(root + path, keys, reader))
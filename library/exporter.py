@@ -0,0 +1,164 @@
+import json
+import os
+import time
+
+from concurrent import futures
+
+import pandas as pd
+
+import audio
+import searcher
+
+
+def write_archive(arg):
+    '''Decrypt and atomically write recordings from one archive. Runs in a worker process.'''
+    audio_path, files, reader = arg
+    fnames = [fname for fname, _ in files]
+    keys = [key for _, key in files]
+
+    written = []
+    for fname, sound_data in zip(fnames, audio.read_archive('../sonyc/' + audio_path, keys, reader)):
+        tmp_name = fname + f'.{os.getpid()}.tmp'
+        with open(tmp_name, 'wb') as f:
+            f.write(sound_data)
+        os.replace(tmp_name, fname)
+        written.append((fname, len(sound_data)))
+
+    return written
+
+def read_manifest(path):
+    try:
+        with open(path + 'manifest.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(path, manifest):
+    tmp_name = path + 'manifest.json.tmp'
+    with open(tmp_name, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_name, path + 'manifest.json')
+
+def is_saved(fname, manifest):
+    '''A file counts as saved if it exists and matches its manifest size, if any.'''
+    try:
+        size = os.path.getsize(fname)
+    except OSError:
+        return False
+    expected = manifest.get(os.path.basename(fname))
+    return size > 0 and (expected is None or expected == size)
+
+def day_tasks(s, day, reader, files_per_task):
+    '''Return the directory for a day, its number of recordings and the work left to do.
+
+    Every task covers at most files_per_task recordings of a single archive.
+    '''
+    path = s.local_audio_path + f'{day}/'
+    os.makedirs(path, exist_ok=True)
+
+    # leftovers of an interrupted run are never valid files
+    for name in os.listdir(path):
+        if name.endswith('.tmp'):
+            os.remove(path + name)
+
+    today = pd.Timestamp(day)
+    interval = s.return_interval(today, today + pd.Timedelta('1d'))
+    manifest = read_manifest(path)
+
+    missing = [index for index in interval['index'] if not is_saved(path + f'{index}.mp3', manifest)]
+
+    tasks = []
+    for audio_path, group in audio.group_by_archive(s.index, missing).items():
+        files = [(path + f'{index}.mp3', s.index['day_h5_index'][index]) for index in group]
+        for i in range(0, len(files), files_per_task):
+            tasks.append((audio_path, files[i:i+files_per_task], reader))
+
+    return path, len(interval), len(missing), tasks
+
+def export_audio(searchers, days, processes=None, reader=None, files_per_task=64):
+    '''Save every recording of every searcher's node on every day.
+
+    Decryption and decoding run on a pool of `processes` workers. Files are
+    written atomically and already saved files are skipped, so an
+    interrupted export can simply be run again. `reader` defaults to
+    private.decrypt.readEncryptedTarAudioFile, imported in each worker on
+    first use, and must be picklable. A task holds the files of one
+    archive, so each worker reads an archive's files one after another.
+
+    Returns a dict with the number of files and bytes written and the
+    throughput in files/s and MB/s.
+    '''
+    if reader is None:
+        reader = searcher.readEncryptedTarAudioFile
+
+    start = time.time()
+    saved = skipped = n_bytes = 0
+
+    manifests = {}
+    tasks = []
+    for s in searchers:
+        for day in days:
+            path, total, n_missing, day_work = day_tasks(s, day, reader, files_per_task)
+            manifests[path] = read_manifest(path)
+            tasks.extend(day_work)
+            skipped += total - n_missing
+            print(f'{s.node} {day}: {n_missing} of {total} files to save')
+
+    try:
+        with futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            for written in executor.map(write_archive, tasks):
+                for fname, size in written:
+                    manifests[os.path.dirname(fname) + '/'][os.path.basename(fname)] = size
+                    saved += 1
+                    n_bytes += size
+    finally:
+        # keep a record of what was written even if the export did not finish
+        for path, manifest in manifests.items():
+            write_manifest(path, manifest)
+
+    elapsed = time.time() - start
+    stats = {
+        'files': saved,
+        'skipped': skipped,
+        'bytes': n_bytes,
+        'seconds': elapsed,
+        'files/s': saved / elapsed if elapsed else 0.0,
+        'MB/s': n_bytes / 2**20 / elapsed if elapsed else 0.0,
+    }
+    print(f"{saved} files saved, {skipped} skipped in {elapsed:.2f} seconds "
+          f"({stats['files/s']:.1f} files/s, {stats['MB/s']:.2f} MB/s)")
+
+    return stats
+
+def export_range(nodes, start_day, end_day, **kwargs):
+    '''export_audio for every node over the inclusive day range [start_day, end_day].
+
+    The range may cross New Year's. Each day is exported from every index
+    of the node that may hold recordings on it (MultiYearSearcher.years_between),
+    so recordings filed in the neighbouring year's index are not missed.
+    They are saved under that index's year, e.g. a recording of 2018-01-01
+    from the 2017 index goes to ../sounds/2017/<node>/2018-01-01/. The
+    returned stats are summed over the years.
+    '''
+    days = pd.date_range(start_day, end_day, freq='D')
+
+    # year -> nodes with an index for it, and the days to look up in it
+    year_nodes, year_days = {}, {}
+    for node in nodes:
+        multi = searcher.MultiYearSearcher(node)
+        for day in days:
+            for year in multi.years_between(day, day + pd.Timedelta('1d')):
+                year_nodes.setdefault(year, set()).add(node)
+                year_days.setdefault(year, set()).add(day.strftime('%Y-%m-%d'))
+    
+    totals = {'files': 0, 'skipped': 0, 'bytes': 0, 'seconds': 0.0}
+    for year in sorted(year_nodes):
+        searchers = [searcher.Searcher(node, year) for node in sorted(year_nodes[year])]
+        stats = export_audio(searchers, sorted(year_days[year]), **kwargs)
+        for key in totals:
+            totals[key] += stats[key]
+        
+    elapsed = totals['seconds']
+    totals['files/s'] = totals['files'] / elapsed if elapsed else 0.0
+    totals['MB/s'] = totals['bytes'] / 2**20 / elapsed if elapsed else 0.0
+    return totals
@@ -0,0 +1,143 @@
+import h5py
+import numpy as np
+import pandas as pd
+
+from alignment import Alignment, stores
+from runner import collect, run_nodes
+
+spl_columns = [
+    'spl_vector',
+    'spl_mean',
+    'spl_std',
+    'spl_l2diff',
+    'spl_l2diff_hourly_pct',
+    'spl_entropy'
+]
+
+coarse_labels = [
+    '1_engine', '2_machinery-impact',
+    '3_non-machinery-impact', '4_powered-saw',
+    '5_alert-signal', '6_music',
+    '7_human-voice', '8_dog'
+]
+
+fine_labels = [
+    '1-1_small-sounding-engine',
+    '1-2_medium-sounding-engine',
+    '1-3_large-sounding-engine',
+    '2-1_rock-drill',
+    '2-2_jackhammer',
+    '2-3_hoe-ram',
+    '2-4_pile-driver',
+    '3-1_non-machinery-impact',
+    '4-1_chainsaw',
+    '4-2_small-medium-rotating-saw',
+    '4-3_large-rotating-saw',
+    '5-1_car-horn',
+    '5-2_car-alarm',
+    '5-3_siren',
+    '5-4_reverse-beeper',
+    '6-1_stationary-music',
+    '6-2_mobile-music',
+    '6-3_ice-cream-truck',
+    '7-1_person-or-small-group-talking',
+    '7-2_person-or-small-group-shouting',
+    '7-3_large-crowd',
+    '7-4_amplified-speech',
+    '8-1_dog-barking-whining'
+]
+
+# feature set -> (path of a node's store, dataset inside it, columns)
+sources = {
+    'spl': stores['spl'] + (spl_columns,),
+    'coarse': stores['coarse'] + (coarse_labels,),
+    'fine': stores['fine'] + (fine_labels,),
+}
+
+
+def source_path(feature_set, node, year=2017):
+    return sources[feature_set][0].format(node=node, year=year)
+
+def read_rows(dataset, columns, rows):
+    '''Read the given columns for rows with a single sorted fancy-index read.
+
+    Returns the structured array for rows in the order they were given.
+    '''
+    unique_rows, inverse = np.unique(rows, return_inverse=True)
+    if len(unique_rows) == 0:
+        return np.empty(0, dtype=dataset.dtype)[list(columns)]
+    block = dataset.fields(list(columns))[unique_rows]
+    return block[inverse]
+
+def node_features(feature_set, node, timestamps, year=2017):
+    '''Look up one node's features for an array of recording timestamps.
+
+    Rows are found through the node's persisted Alignment, so the store's
+    timestamp column is only read the first time. Returns the positions in
+    timestamps that were found and their features; timestamps without a
+    row in the store are reported and skipped.
+    '''
+    _, dataset_name, columns = sources[feature_set]
+    timestamps = np.asarray(timestamps)
+
+    rows = Alignment(node, year).rows(feature_set, timestamps)
+    found = np.flatnonzero(rows >= 0)
+    if len(found) < len(rows):
+        missing = timestamps[rows < 0]
+        print(f'{node}: {len(missing)} of {len(rows)} timestamps have no {feature_set} features and are skipped, e.g. {missing[0]}')
+
+    with h5py.File(source_path(feature_set, node, year), 'r') as f:
+        return found, read_rows(f[dataset_name], columns, rows[found])
+
+def get_features(df, feature_set, year=2017, processes=1, max_open_files=None, return_errors=False):
+    '''Return a frame of features for every (node, node_timestamp) row of df.
+
+    Rows are grouped by node so that each node's store is opened and read
+    once, and nodes are spread over `processes` worker processes. The result
+    has the index of df and one column per feature; vector features such as
+    spl_vector hold one array per row. Rows whose recording has no features
+    are left out of the result, so join it with df on the index (e.g.
+    pd.concat with join='inner').
+
+    If a node fails, a RuntimeError naming it is raised, unless
+    return_errors is set: then (features, {node: error}) is returned, with
+    the features of every node that was read.
+    '''
+    columns = sources[feature_set][2]
+    node_rows = df.groupby('node', sort=True).indices
+    timestamps = df['node_timestamp'].values
+
+    tasks = {
+        node: (feature_set, node, timestamps[rows], year)
+        for node, rows in node_rows.items()
+    }
+    results, _, errors = collect(run_nodes(node_features, tasks, processes, max_open_files))
+    if errors and not return_errors:
+        raise_node_errors(feature_set, errors)
+
+    features = assemble(df, columns, [
+        (node_rows[node][found], data) for node, (found, data) in results.items() if len(found)
+    ])
+    return (features, errors) if return_errors else features
+
+def raise_node_errors(feature_set, errors):
+    raise RuntimeError(f'{feature_set} features could not be read for {len(errors)} nodes: {", ".join(sorted(errors))}')
+
+def assemble(df, columns, parts):
+    '''A frame indexed like df from (row positions in df, structured array) parts.'''
+    if not parts:
+        return pd.DataFrame(columns=columns, index=df.index[:0])
+
+    rows = np.sort(np.concatenate([node_rows for node_rows, _ in parts]))
+    position = np.full(len(df), -1)
+    position[rows] = np.arange(len(rows))
+
+    result = {}
+    for column in columns:
+        first = parts[0][1][column]
+        values = np.empty((len(rows),) + first.shape[1:], dtype=first.dtype)
+        for node_rows, data in parts:
+            values[position[node_rows]] = data[column]
+        result[column] = list(values) if values.ndim > 1 else values
+
+    return pd.DataFrame(result, index=df.index[rows], columns=columns)
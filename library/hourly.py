@@ -0,0 +1,195 @@
+import os
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from features import read_rows, source_path, sources
+from runner import collect, run_nodes
+
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+# hours of recordings read per step; only this many hours of a node's store
+# are held in memory at once
+BLOCK_HOURS = 24 * 7
+
+
+def year_hours(year):
+    '''Start of every UTC hour of year.'''
+    return pd.date_range(f'{year}-01-01', f'{year + 1}-01-01', freq='h', inclusive='left')
+
+def scalar_columns(dataset, columns):
+    '''The columns of dataset holding one value per recording (e.g. not spl_vector).'''
+    return [column for column in columns if dataset.dtype[column].shape == ()]
+
+def read_block(dataset, columns, rows):
+    '''Read columns at rows as a (rows, columns) float64 array, in the order of rows.
+
+    Recordings are stored roughly in time order, so the rows of a block of
+    hours usually form one short contiguous range that is read as a slice.
+    '''
+    lo, hi = rows.min(), rows.max() + 1
+    if hi - lo <= 4 * len(rows):
+        data = dataset.fields(columns)[lo:hi][rows - lo]
+    else:
+        data = read_rows(dataset, columns, rows)
+    return np.column_stack([data[column] for column in columns]).astype(np.float64)
+
+def hourly_stats(hours, values, quantiles=QUANTILES):
+    '''Count, mean, std and quantiles of values (rows x features) for each hour.
+
+    hours must be sorted. Returns the distinct hours and, for each of them,
+    the count, the mean and std (ddof=1, like pandas) of every feature and
+    its quantiles (linear interpolation, like np.quantile) as an
+    (hours, features, quantiles) array.
+    '''
+    starts = np.flatnonzero(np.r_[True, hours[1:] != hours[:-1]])
+    count = np.diff(np.r_[starts, len(hours)])
+    group = np.repeat(np.arange(len(starts)), count)
+
+    mean = np.add.reduceat(values, starts, axis=0) / count[:, None]
+    m2 = np.add.reduceat((values - mean[group]) ** 2, starts, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(m2 / (count - 1)[:, None])
+
+    # sort values within each hour, then interpolate between the two ranks
+    # around q * (count - 1) like np.quantile does
+    position = starts[:, None] + np.asarray(quantiles)[None, :] * (count - 1)[:, None]
+    below = np.floor(position).astype(np.int64)
+    above = np.ceil(position).astype(np.int64)
+    fraction = position - below
+
+    result = np.empty((len(starts), values.shape[1], len(quantiles)))
+    for feature in range(values.shape[1]):
+        ordered = values[np.lexsort((values[:, feature], hours)), feature]
+        result[:, feature] = ordered[below] + (ordered[above] - ordered[below]) * fraction
+
+    return hours[starts], count, mean, std, result
+
+def node_hourly(feature_set, node, year=2017, quantiles=QUANTILES, block_hours=BLOCK_HOURS):
+    '''Hourly statistics of every recording of one node for a year.
+
+    Returns a dict of arrays with one row per hour of the year: count
+    (hours,), mean and std (hours, features) and quantiles (hours,
+    features, quantiles); hours without recordings are NaN.
+    '''
+    _, dataset_name, columns = sources[feature_set]
+    n_hours = len(year_hours(year))
+    start = pd.Timestamp(f'{year}-01-01').value // 10**9
+
+    with h5py.File(source_path(feature_set, node, year), 'r') as f:
+        dataset = f[dataset_name]
+        columns = scalar_columns(dataset, columns)
+
+        hour = (dataset.fields('timestamp')[:] - start) // 3600
+        keep = np.flatnonzero((hour >= 0) & (hour < n_hours))
+        order = keep[np.argsort(hour[keep], kind='stable')]
+        sorted_hours = hour[order].astype(np.int64)
+
+        result = {
+            'columns': columns,
+            'count': np.zeros(n_hours, dtype=np.int32),
+            'mean': np.full((n_hours, len(columns)), np.nan, dtype=np.float32),
+            'std': np.full((n_hours, len(columns)), np.nan, dtype=np.float32),
+            'quantiles': np.full((n_hours, len(columns), len(quantiles)), np.nan, dtype=np.float32),
+        }
+
+        for block in range(0, n_hours, block_hours):
+            lo, hi = np.searchsorted(sorted_hours, [block, block + block_hours])
+            if lo == hi:
+                continue
+
+            values = read_block(dataset, columns, order[lo:hi])
+            hours, count, mean, std, quantile = hourly_stats(sorted_hours[lo:hi], values, quantiles)
+            result['count'][hours] = count
+            result['mean'][hours] = mean
+            result['std'][hours] = std
+            result['quantiles'][hours] = quantile
+
+    return result
+
+def aggregate(feature_set, nodes, year=2017, quantiles=QUANTILES, processes=None, max_open_files=None):
+    '''Build the node x hour x feature cube of a feature set over a process pool.
+
+    Nodes that fail are reported and left out of the cube.
+    '''
+    tasks = {node: (feature_set, node, year, quantiles) for node in sorted(nodes)}
+    results, _, _ = collect(run_nodes(node_hourly, tasks, processes, max_open_files))
+
+    nodes = sorted(results)
+    if not nodes:
+        raise ValueError(f'no {feature_set} data could be read for any node')
+
+    return {
+        'nodes': np.array(nodes),
+        'hours': year_hours(year).to_numpy(),
+        'features': np.array(results[nodes[0]]['columns']),
+        'quantile_levels': np.array(quantiles),
+        'count': np.stack([results[node]['count'] for node in nodes]),
+        'mean': np.stack([results[node]['mean'] for node in nodes]),
+        'std': np.stack([results[node]['std'] for node in nodes]),
+        'quantiles': np.stack([results[node]['quantiles'] for node in nodes]),
+    }
+
+def combine_nodes(cube):
+    '''Pool the count, mean and std of every hour over all nodes of a cube.
+
+    Counts, means and squared deviations merge exactly, so this equals the
+    statistics over the recordings of all nodes together. Quantiles do not
+    merge and are left out.
+    '''
+    count = cube['count'].astype(np.float64)[:, :, None]
+    mean = np.nan_to_num(cube['mean'].astype(np.float64))
+    m2 = np.nan_to_num(cube['std'].astype(np.float64)) ** 2 * np.maximum(count - 1, 0)
+
+    total = count.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pooled_mean = (count * mean).sum(axis=0) / total
+        pooled_m2 = (m2 + count * (mean - pooled_mean) ** 2).sum(axis=0)
+        pooled_std = np.sqrt(pooled_m2 / (total - 1))
+
+    return {
+        'hours': cube['hours'],
+        'features': cube['features'],
+        'count': total[:, 0].astype(np.int64),
+        'mean': pooled_mean,
+        'std': pooled_std,
+    }
+
+def write_cube(path, cube):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, **cube)
+    os.replace(tmp_path, path)
+
+def read_cube(path):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+def cube_frame(cube, stat='mean', quantile=None):
+    '''One row per (node, hour) with recordings and one column per feature.
+
+    stat is 'mean', 'std' or 'quantile'; for the latter, quantile picks the
+    level (e.g. 0.5). The datetime[utc] column is the start of the hour.
+    '''
+    if stat == 'quantile':
+        level = list(cube['quantile_levels']).index(quantile)
+        values = cube['quantiles'][..., level]
+    else:
+        values = cube[stat]
+
+    node, hour = np.nonzero(cube['count'])
+    frame = pd.DataFrame(values[node, hour], columns=cube['features'])
+    frame.insert(0, 'count', cube['count'][node, hour])
+    frame.insert(0, 'datetime[utc]', cube['hours'][hour])
+    frame.insert(0, 'node', cube['nodes'][node])
+    return frame
+
+def join_weather(frame, weather_df):
+    '''Attach each weather observation to the hour it falls in.
+
+    weather_df is e.g. weather-hourly.csv read with parse_dates; observations
+    are matched on their time floored to the hour.
+    '''
+    weather_df = weather_df.assign(**{'datetime[utc]': weather_df['datetime[utc]'].dt.floor('h')})
+    return frame.merge(weather_df, on='datetime[utc]', how='inner')
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+CACHE_DIR = '../cache/indices/'
+MAX_BYTES = 20 * 2**30
+COLUMNS = ('timestamp', 'day_hdf5_path', 'day_h5_index')
+
+
+class IndexCache:
+    '''Local, memory-mappable copies of the recording index columns.
+
+    Each cached index lives in its own directory holding one .npy file per
+    column plus a meta.json. The directory name is derived from the source
+    path, mtime and size, so a changed source file never hits a stale entry.
+    Once the cache grows past max_bytes the least recently used entries are
+    removed.
+    '''
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES, columns=COLUMNS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.columns = tuple(columns)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, index_path):
+        stat = os.stat(index_path)
+        source = f'{os.path.abspath(index_path)}:{stat.st_mtime_ns}:{stat.st_size}:{",".join(self.columns)}'
+        digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+        name = os.path.basename(index_path).split('_')[0]
+        return f'{name}-{digest}'
+
+    def load(self, index_path):
+        '''Return {column: read-only memmap} for index_path, extracting it on a miss.'''
+        entry = os.path.join(self.cache_dir, self.key(index_path))
+        if not os.path.exists(os.path.join(entry, 'meta.json')):
+            self.invalidate(index_path)
+            self._extract(index_path, entry)
+            self.evict(keep=entry)
+
+        self._touch(entry)
+        return {
+            column: np.load(os.path.join(entry, f'{column}.npy'), mmap_mode='r')
+            for column in self.columns
+        }
+
+    def invalidate(self, index_path=None):
+        '''Drop every entry for index_path, or the whole cache if no path is given.'''
+        source = None if index_path is None else os.path.abspath(index_path)
+        for entry, meta in self._entries():
+            if source is None or meta['source'] == source:
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def evict(self, keep=None):
+        '''Remove least recently used entries until the cache fits in max_bytes.'''
+        entries = sorted(self._entries(), key=lambda _: _[1]['last_used'])
+        total = sum(meta['bytes'] for _, meta in entries)
+        for entry, meta in entries:
+            if total <= self.max_bytes:
+                break
+            if entry == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= meta['bytes']
+
+    def _extract(self, index_path, entry):
+        # write into a temporary directory and rename it into place so that
+        # concurrent readers never see a half-written entry
+        tmp = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            with h5py.File(index_path, 'r') as f:
+                data = f['recording_index'][self.columns]
+
+            size = 0
+            for column in self.columns:
+                column_path = os.path.join(tmp, f'{column}.npy')
+                np.save(column_path, _plain(data[column]))
+                size += os.path.getsize(column_path)
+
+            meta = {
+                'source': os.path.abspath(index_path),
+                'columns': list(self.columns),
+                'rows': len(data),
+                'bytes': size,
+                'last_used': time.time(),
+            }
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+
+            os.rename(tmp, entry)
+        except OSError:
+            # another process won the race to create the entry
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(os.path.join(entry, 'meta.json')):
+                raise
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    def _touch(self, entry):
+        meta_path = os.path.join(entry, 'meta.json')
+        with open(meta_path) as f:
+            meta = json.load(f)
+        meta['last_used'] = time.time()
+
+        tmp_path = meta_path + f'.{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def _entries(self):
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            try:
+                with open(os.path.join(entry, 'meta.json')) as f:
+                    yield entry, json.load(f)
+            except (OSError, ValueError):
+                continue
+
+
+def _plain(array):
+    # h5py tags string columns with dtype metadata and variable-length strings
+    # come back as objects; neither survives a memory-mapped .npy file
+    if array.dtype.kind == 'O':
+        return np.array(array.tolist(), dtype='S')
+    return np.ascontiguousarray(array).view(np.dtype(array.dtype.str))
+
+
+_default_cache = None
+
+def load_index(index_path, cache=None):
+    '''Return the cached index columns for index_path using the default cache.'''
+    global _default_cache
+    if cache is None:
+        if _default_cache is None:
+            _default_cache = IndexCache()
+        cache = _default_cache
+    return cache.load(index_path)
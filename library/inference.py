@@ -0,0 +1,199 @@
+import os
+import pickle
+import sys
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from alignment import store_path, stores
+from features import coarse_labels, fine_labels, read_rows
+from runner import collect, run_nodes
+
+# bytes of features read and predicted at once; with the hourly sums below
+# this (plus a year of one node's timestamps) is what a node holds in memory
+CHUNK_BYTES = 2**26
+
+# feature set -> columns of the store the models were trained on, in order.
+# The class-prediction notebooks train on columns[3:-1] of the predictions
+# csv, which leaves out the last label (dog); the saved-models/*.model files
+# written by embeddings-analysis.py are openl3 models.
+model_columns = {
+    'spl': ['spl_mean', 'spl_std', 'spl_l2diff', 'spl_entropy'],
+    'coarse': coarse_labels[:-1],
+    'fine': fine_labels[:-1],
+    'openl3': ['openl3'],
+}
+
+# the scripts directory holding ann.py, which the approximate KNN models
+# (e.g. saved-models/coarse-ann) need to be unpickled
+ANN_ROOT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'prince', 'scratch', 'connections-in-ml', 'scripts'
+)
+
+_models = {}
+
+
+def epoch(time):
+    return pd.Timestamp(time).value // 10**9
+
+def read_model(path):
+    '''Unpickle a model; one saved with its IVF index next to it (ann.save) is read with ann.load.'''
+    if os.path.isdir(path + '.index'):
+        if ANN_ROOT not in sys.path:
+            sys.path.append(ANN_ROOT)
+        import ann
+        return ann.load(path)
+
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except ModuleNotFoundError as e:
+        if e.name != 'ann':
+            raise
+        raise ValueError(f'{path} is an approximate KNN model, but its index {path}.index/ is missing') from e
+
+def load_model(path, reducer_path=None):
+    '''Read a model (see read_model), and optionally the reducer of its embeddings, once per process.'''
+    key = (path, reducer_path)
+    if key not in _models:
+        model = read_model(path)
+        reducer = None
+        if reducer_path is not None:
+            with open(reducer_path, 'rb') as f:
+                reducer = pickle.load(f)
+        _models[key] = (model, reducer)
+    return _models[key]
+
+def rain_probability(model, X):
+    '''Probability of rain for each row of X, or the 0/1 prediction for models without predict_proba.'''
+    if hasattr(model, 'predict_proba'):
+        proba = model.predict_proba(X)
+        rainy = np.flatnonzero(model.classes_ == 1)
+        return proba[:, rainy[0]] if len(rainy) else np.zeros(len(X))
+    return (model.predict(X) == 1).astype(np.float64)
+
+def feature_matrix(data, columns):
+    '''Stack columns of a structured array into a float32 matrix; vector columns are flattened.'''
+    return np.column_stack([data[column].reshape(len(data), -1) for column in columns]).astype(np.float32)
+
+def model_features(model, feature_set, columns=None):
+    '''The store columns to feed model: columns, the names the model was fit with, or model_columns.'''
+    if columns is not None:
+        return list(columns)
+    names = getattr(model, 'feature_names_in_', None)
+    if names is None:
+        return model_columns[feature_set]
+    # the predictions csvs name the labels without their number prefix
+    labels = {'coarse': coarse_labels, 'fine': fine_labels}.get(feature_set, [])
+    store_names = {label.split('_', 1)[1]: label for label in labels}
+    return [store_names.get(name, name) for name in names]
+
+def check_width(model, reducer, feature_set, X):
+    expected = getattr(reducer if reducer is not None else model, 'n_features_in_', X.shape[1])
+    if expected != X.shape[1]:
+        raise ValueError(
+            f'the model expects {expected} features but the {feature_set} columns give {X.shape[1]}; '
+            f'pass the feature set (or columns) it was trained on'
+        )
+
+def iter_chunks(feature_set, node, start, end, columns=None, chunk_bytes=CHUNK_BYTES):
+    '''Yield (timestamps, feature matrix) for a node's recordings in [start, end), in time order.
+
+    start and end are epoch seconds and may span years; each year's store
+    is opened in turn. Chunks are sized so that reading one holds about
+    chunk_bytes of features, whatever the width of a row.
+    '''
+    columns = columns or model_columns[feature_set]
+    dataset_name = stores[feature_set][1]
+
+    for year in range(pd.Timestamp(start, unit='s').year, pd.Timestamp(end - 1, unit='s').year + 1):
+        path = store_path(feature_set, node, year)
+        if path is None:
+            continue
+
+        with h5py.File(path, 'r') as f:
+            dataset = f[dataset_name]
+            # a chunk's rows may be read as a slice up to 4 times as long
+            row_bytes = sum(dataset.dtype[column].itemsize for column in columns)
+            chunk_rows = max(1, chunk_bytes // (4 * row_bytes))
+
+            timestamps = dataset.fields('timestamp')[:]
+            keep = np.flatnonzero((timestamps >= start) & (timestamps < end))
+            order = keep[np.argsort(timestamps[keep], kind='stable')]
+
+            for lo in range(0, len(order), chunk_rows):
+                rows = order[lo:lo + chunk_rows]
+                # recordings are stored roughly in time order, so a chunk is
+                # usually one short range that is read as a slice
+                first, last = rows.min(), rows.max() + 1
+                if last - first <= 4 * len(rows):
+                    data = dataset.fields(columns)[first:last][rows - first]
+                else:
+                    data = read_rows(dataset, columns, rows)
+                yield timestamps[rows], feature_matrix(data, columns)
+
+def node_rain(node, model_path, feature_set, start, end, columns=None, reducer_path=None, chunk_bytes=CHUNK_BYTES):
+    '''Hourly rain probability of one node over [start, end) (epoch seconds).
+
+    Returns a frame with one row per hour that has recordings: its start,
+    the number of recordings, their mean rain probability and the fraction
+    of them predicted rainy.
+    '''
+    model, reducer = load_model(model_path, reducer_path)
+    columns = model_features(model, feature_set, columns)
+
+    first_hour = start // 3600
+    n_hours = (end - 1) // 3600 - first_hour + 1
+
+    count = np.zeros(n_hours, dtype=np.int64)
+    probability = np.zeros(n_hours)
+    rainy = np.zeros(n_hours, dtype=np.int64)
+
+    for timestamps, X in iter_chunks(feature_set, node, start, end, columns, chunk_bytes):
+        check_width(model, reducer, feature_set, X)
+        if reducer is not None:
+            X = reducer.transform(X)
+        chunk_probability = rain_probability(model, X)
+
+        hours = (timestamps // 3600 - first_hour).astype(np.int64)
+        count += np.bincount(hours, minlength=n_hours)
+        probability += np.bincount(hours, weights=chunk_probability, minlength=n_hours)
+        rainy += np.bincount(hours, weights=chunk_probability >= 0.5, minlength=n_hours).astype(np.int64)
+
+    hours = np.flatnonzero(count)
+    return pd.DataFrame({
+        'node': node,
+        'datetime[utc]': pd.to_datetime((first_hour + hours) * 3600, unit='s'),
+        'count': count[hours],
+        'rain_probability': probability[hours] / count[hours],
+        'rainy_fraction': rainy[hours] / count[hours],
+    })
+
+def infer(nodes, model_path, feature_set, start, end, columns=None, reducer_path=None,
+          chunk_bytes=CHUNK_BYTES, processes=None, max_open_files=None):
+    '''Hourly rain probability of every node over [start, end), nodes in parallel.
+
+    start and end are anything pd.Timestamp accepts, in UTC. The columns
+    fed to the model default to model_features. Each worker loads the model
+    once. Nodes that fail are reported and left out.
+    '''
+    model_path = os.path.abspath(model_path)
+    reducer_path = reducer_path and os.path.abspath(reducer_path)
+    tasks = {
+        node: (node, model_path, feature_set, epoch(start), epoch(end), columns, reducer_path, chunk_bytes)
+        for node in sorted(nodes)
+    }
+    results, _, _ = collect(run_nodes(node_rain, tasks, processes, max_open_files))
+
+    columns = ['node', 'datetime[utc]', 'count', 'rain_probability', 'rainy_fraction']
+    frames = [results[node] for node in sorted(results)]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True).sort_values(['datetime[utc]', 'node'], kind='stable', ignore_index=True)
+
+def with_locations(frame, nodes_table):
+    '''Add the latitude and longitude of each node (from nodes.read_nodes) for mapping.'''
+    locations = nodes_table.rename(columns={'name': 'node'})[['node', 'latitude', 'longitude']]
+    return frame.merge(locations, on='node', how='left')
@@ -0,0 +1,143 @@
+import glob
+import os
+import time
+
+from concurrent import futures
+
+import numpy as np
+import pandas as pd
+
+from weather import fill_gaps, parse_precip
+
+CHUNKSIZE = 100000
+
+# the fill weather-hourly-cleaner.py uses for weather-hourly.csv, so that the
+# store and the csv agree on which hours rained
+DEFAULT_STRATEGY = 'zero'
+
+# raw Iowa Environmental Mesonet columns -> names used in the rest of the project
+column_names = {
+    'valid': 'datetime[utc]',
+    'sknt': 'windspeed[knots]',
+    'p01m': 'precipitation[mm]',
+}
+
+# everything except the timestamp and precipitation is plain numeric, with M
+# for missing; precipitation also has T for trace amounts
+raw_dtypes = {
+    'station': 'string',
+    'valid': 'string',
+    'p01m': 'string',
+}
+numeric_dtype = 'float64'
+
+
+def read_raw_chunks(path, chunksize=CHUNKSIZE):
+    '''Yield the raw rows of a Mesonet CSV in chunks with explicit dtypes.'''
+    columns = pd.read_csv(path, nrows=0).columns
+    dtypes = {column: raw_dtypes.get(column, numeric_dtype) for column in columns}
+
+    yield from pd.read_csv(
+        path,
+        dtype=dtypes,
+        na_values={column: ['M'] for column in columns if column not in raw_dtypes},
+        keep_default_na=False,
+        chunksize=chunksize,
+    )
+
+def parse_chunk(chunk):
+    '''Convert a raw chunk to typed columns, leaving missing precipitation as NaN.'''
+    chunk = chunk.copy()
+    chunk['valid'] = pd.to_datetime(chunk['valid'], format='%Y-%m-%d %H:%M')
+    chunk['p01m'] = parse_precip(chunk['p01m']).astype(float)
+    return chunk.reset_index(drop=True)
+
+def clean_chunks(chunks, strategy=DEFAULT_STRATEGY):
+    '''Fill precipitation gaps across a stream of parsed chunks.
+
+    Rows after the last observation of a chunk are held back until the next
+    observation arrives, so every gap is filled knowing both of its ends
+    while only one chunk (plus any open gap) is in memory.
+    '''
+    carry = None
+    for chunk in chunks:
+        buffer = chunk if carry is None else pd.concat([carry, chunk], ignore_index=True)
+        observed = np.flatnonzero(buffer['p01m'].notna().to_numpy())
+        if not len(observed):
+            carry = buffer
+            continue
+
+        last = observed[-1]
+        ready = buffer.iloc[:last].copy()
+        carry = buffer.iloc[last:].reset_index(drop=True)
+
+        if len(ready):
+            # the last observation stays in the buffer as the left end of the next gap
+            values = fill_gaps(buffer['p01m'].to_numpy()[:last + 1], strategy)
+            ready['p01m'] = values[:last]
+            yield ready
+
+    if carry is not None and len(carry):
+        carry = carry.copy()
+        carry['p01m'] = fill_gaps(carry['p01m'].to_numpy(), strategy)
+        yield carry
+
+def write_partitions(df, store, stem, part):
+    '''Write df under store/station=<station>/year=<year>/<stem>-<part>.parquet.'''
+    df = df.rename(columns=column_names)
+    years = df['datetime[utc]'].dt.year
+    for (station, year), group in df.groupby([df['station'], years], sort=False):
+        path = os.path.join(store, f'station={station}', f'year={year}')
+        os.makedirs(path, exist_ok=True)
+        group.drop(columns='station').to_parquet(
+            os.path.join(path, f'{stem}-{part:05d}.parquet'),
+            index=False
+        )
+
+def part_pattern(store, stem):
+    '''Glob of the parts write_partitions writes for one source file, and no other file's.'''
+    return os.path.join(store, '*', '*', glob.escape(stem) + '-[0-9][0-9][0-9][0-9][0-9].parquet')
+
+def ingest_file(path, store, strategy=DEFAULT_STRATEGY, chunksize=CHUNKSIZE):
+    '''Stream one raw CSV into the partitioned store; returns (path, rows, seconds).'''
+    start = time.time()
+    stem = os.path.splitext(os.path.basename(path))[0]
+
+    # drop what an earlier run wrote for this file so reruns replace it
+    for old in glob.glob(part_pattern(store, stem)):
+        os.remove(old)
+
+    rows = 0
+    parsed = (parse_chunk(chunk) for chunk in read_raw_chunks(path, chunksize))
+    for part, chunk in enumerate(clean_chunks(parsed, strategy)):
+        write_partitions(chunk, store, stem, part)
+        rows += len(chunk)
+
+    return path, rows, time.time() - start
+
+def ingest(paths, store, strategy=DEFAULT_STRATEGY, chunksize=CHUNKSIZE, processes=None):
+    '''Ingest many raw station files in parallel.'''
+    with futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        jobs = [executor.submit(ingest_file, path, store, strategy, chunksize) for path in paths]
+        for job in futures.as_completed(jobs):
+            path, rows, seconds = job.result()
+            print(f'{rows} rows from {path} ingested in {seconds:.2f} seconds')
+
+def read_weather(store, station, start=None, end=None, columns=None):
+    '''Read one station's cleaned observations in [start, end) from the store.
+
+    Station, year and time filters are pushed down to the Parquet reader, so
+    only the matching partitions and row groups are read.
+    '''
+    filters = [('station', '==', station)]
+    if start is not None:
+        start = pd.Timestamp(start)
+        filters += [('year', '>=', start.year), ('datetime[utc]', '>=', start)]
+    if end is not None:
+        end = pd.Timestamp(end)
+        filters += [('year', '<=', end.year), ('datetime[utc]', '<', end)]
+
+    df = pd.read_parquet(store, columns=columns, filters=filters)
+    return (df.drop(columns=['station', 'year'], errors='ignore')
+              .sort_values('datetime[utc]')
+              .reset_index(drop=True))
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+TIME = 'datetime[utc]'
+PRECIP = 'precipitation[mm]'
+
+
+def rainy(df, precip=PRECIP):
+    '''Rows with any precipitation.'''
+    return df[precip] > 0.0
+
+def dry_days(df, time=TIME, precip=PRECIP):
+    '''Days on which every observation reported exactly zero precipitation.'''
+    is_dry = (df[precip] == 0).groupby(df[time].dt.floor('D')).all()
+    return is_dry.index[is_dry.to_numpy()]
+
+def dry_day(df, time=TIME, precip=PRECIP):
+    '''Rows that fall on a dry day.'''
+    return df[time].dt.floor('D').isin(dry_days(df, time, precip))
+
+def rainy_hours(df, time=TIME, precip=PRECIP):
+    '''Hours (floored) with at least one rainy observation.'''
+    is_rainy = rainy(df, precip).groupby(df[time].dt.floor('h')).any()
+    return is_rainy.index[is_rainy.to_numpy()]
+
+def rainy_hour(df, time=TIME, precip=PRECIP):
+    '''Rows that fall in an hour with rain.'''
+    return df[time].dt.floor('h').isin(rainy_hours(df, time, precip))
+
+def rain_events(df, time=TIME, precip=PRECIP):
+    '''Contiguous runs of rainy observations, one row per event.
+
+    Observations are taken in time order; an event ends at the first
+    observation without rain.
+    '''
+    df = df.sort_values(time)
+    wet = rainy(df, precip).to_numpy()
+    onset = wet & ~np.r_[False, wet[:-1]]
+    event = np.cumsum(onset)
+
+    events = df[wet].groupby(event[wet]).agg(
+        start=(time, 'first'),
+        end=(time, 'last'),
+        observations=(time, 'size'),
+        total_precipitation=(precip, 'sum'),
+    )
+    return events.reset_index(drop=True)
+
+def rain_onset(df, time=TIME, precip=PRECIP):
+    '''Rows that start a rain event.'''
+    order = np.argsort(df[time].to_numpy(), kind='stable')
+    wet = rainy(df, precip).to_numpy()[order]
+    onset = np.empty(len(df), dtype=bool)
+    onset[order] = wet & ~np.r_[False, wet[:-1]]
+    return pd.Series(onset, index=df.index)
+
+def within(df, mask, before='0h', after='0h', time=TIME):
+    '''Rows whose time lies within [t - before, t + after] of some row flagged in mask.
+
+    For example within(df, rain_onset(df), after='3h') flags the three
+    hours following each onset, and within(df, rainy(df), before='6h',
+    after='6h') flags everything within six hours of rain.
+    '''
+    times = df[time].to_numpy()
+    anchors = np.sort(times[np.asarray(mask)])
+    if not len(anchors):
+        return pd.Series(False, index=df.index)
+
+    # the closest anchor at or after t - after must also be at or before t + before
+    position = np.searchsorted(anchors, times - pd.Timedelta(after).to_timedelta64(), side='left')
+    found = position < len(anchors)
+    candidate = anchors[np.minimum(position, len(anchors) - 1)]
+    hit = found & (candidate <= times + pd.Timedelta(before).to_timedelta64())
+    return pd.Series(hit, index=df.index)
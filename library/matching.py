@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def sort_timestamps(timestamps):
+    '''Return (order, sorted timestamps) so a node's index only has to be sorted once.'''
+    timestamps = np.asarray(timestamps)
+    order = np.argsort(timestamps, kind='stable')
+    return order, np.ascontiguousarray(timestamps[order])
+
+def nearest(order, sorted_timestamps, epochs):
+    '''Return the index of the closest recording for every epoch and its signed diff.
+
+    Matches np.argmin(abs(timestamps - epoch)) exactly, including ties, which
+    resolve to the smallest original index.
+    '''
+    epochs = np.asarray(epochs)
+    n = len(sorted_timestamps)
+
+    right = np.searchsorted(sorted_timestamps, epochs, side='left')
+    left = np.maximum(right - 1, 0)
+    right = np.minimum(right, n - 1)
+
+    # argmin picks the first of several equal timestamps; the stable sort puts
+    # the smallest original index at the start of each run of duplicates
+    left = np.searchsorted(sorted_timestamps, sorted_timestamps[left], side='left')
+
+    left_dist = np.abs(sorted_timestamps[left] - epochs)
+    right_dist = np.abs(sorted_timestamps[right] - epochs)
+
+    left_index = order[left]
+    right_index = order[right]
+    use_left = (left_dist < right_dist) | ((left_dist == right_dist) & (left_index < right_index))
+
+    index = np.where(use_left, left_index, right_index)
+    return index, sorted_timestamps[np.where(use_left, left, right)] - epochs
+
+def match_nearest(timestamps, epochs, max_diff=None):
+    '''Match every epoch to its closest recording in timestamps.
+
+    Returns a dict of columnar arrays: 'node_index' (row in timestamps),
+    'rain_index' (position in epochs) and 'diff' (node - epoch). If max_diff
+    is given, matches with abs(diff) > max_diff are dropped.
+    '''
+    epochs = np.asarray(epochs)
+    if len(timestamps) == 0:
+        empty = np.array([], dtype=np.int64)
+        return {'node_index': empty, 'rain_index': empty, 'diff': np.array([], dtype=np.float64)}
+
+    node_index, diff = nearest(*sort_timestamps(timestamps), epochs)
+    rain_index = np.arange(len(epochs))
+
+    if max_diff is not None:
+        keep = np.abs(diff) <= max_diff
+        node_index, rain_index, diff = node_index[keep], rain_index[keep], diff[keep]
+
+    return {'node_index': node_index, 'rain_index': rain_index, 'diff': diff}
+
+def match_closest_instances(node_indices, epochs, max_diff=None):
+    '''Run match_nearest for every node in a {node: recording index} dict.'''
+    return {
+        node: match_nearest(indices['timestamp'], epochs, max_diff)
+        for node, indices in node_indices.items()
+    }
+
+def build_instance_df(node_indices, rain_df, closest_instances):
+    '''Build the audio-paths table from match_closest_instances output.
+
+    Every node's matched rows are gathered with one fancy index into its
+    recording index and written straight into preallocated columns; paths
+    are decoded from bytes once for the whole table.
+    '''
+    sizes = [len(closest_instances[node]['node_index']) for node in node_indices]
+    total = sum(sizes)
+
+    rain_epochs = rain_df['datetime[epoch]'].values
+    precipitation = rain_df['precipitation[mm]'].values
+
+    node_ts = np.empty(total, dtype=np.float64)
+    rain_ts = np.empty(total, dtype=rain_epochs.dtype)
+    precip = np.empty(total, dtype=precipitation.dtype)
+    index = np.empty(total, dtype=np.int64)
+    paths = []
+
+    start = 0
+    for (node, indices), size in zip(node_indices.items(), sizes):
+        matches = closest_instances[node]
+        node_index = matches['node_index']
+        stop = start + size
+
+        node_ts[start:stop] = indices['timestamp'][node_index]
+        rain_ts[start:stop] = rain_epochs[matches['rain_index']]
+        precip[start:stop] = precipitation[matches['rain_index']]
+        index[start:stop] = indices['day_h5_index'][node_index]
+        paths.append(indices['day_hdf5_path'][node_index])
+
+        start = stop
+
+    paths = np.concatenate(paths) if paths else np.array([], dtype='S1')
+
+    return pd.DataFrame({
+        'node_timestamp': node_ts,
+        'rain_timestamp': rain_ts,
+        'diff': node_ts - rain_ts,
+        'precipitation[mm]': precip,
+        'path': np.char.decode(paths, 'utf-8').astype(object),
+        'index': index,
+    })
+
+def with_node(df):
+    '''The table with the node of each recording split out of its path, for filtering on it.'''
+    return df.assign(node=df['path'].str.split('/').str[2])
+
+def write_parquet(df, parquet_path):
+    '''Atomically write the Parquet copy of a table that sampling.load_instances reads.'''
+    tmp_path = parquet_path + '.tmp'
+    with_node(df).to_parquet(tmp_path, index=False, row_group_size=2**16)
+    os.replace(tmp_path, parquet_path)
+
+def write_instance_df(df, csv_path, extra_formats=()):
+    '''Write the table to csv_path and, optionally, as parquet/feather next to it.
+
+    The columnar copies also have a 'node' column (see with_node).
+    '''
+    df.to_csv(csv_path, index=False)
+
+    base = os.path.splitext(csv_path)[0]
+    for fmt in extra_formats:
+        if fmt == 'parquet':
+            write_parquet(df, base + '.parquet')
+        elif fmt == 'feather':
+            with_node(df).to_feather(base + '.feather')
+        else:
+            raise ValueError(f'unknown format {fmt}')
@@ -0,0 +1,139 @@
+import json
+import os
+
+from concurrent import futures
+
+import h5py
+import numpy as np
+import pandas as pd
+
+INDEX_DIR = '../sonyc/indices/{year}/'
+MANIFEST_PATH = '../data/nodes-{year}.json'
+NODES_PATH = '../data/nodes.txt'
+
+# breaks in recording longer than this are listed as gaps in the manifest
+GAP_SECONDS = 6 * 60 * 60
+
+
+def read_nodes(path=NODES_PATH):
+    '''Return the sensor locations in nodes.txt as a DataFrame.'''
+    table = pd.read_csv(path, sep=' ', header=None, names=['name', 'latitude', 'longitude'])
+    return table
+
+def describe_index(path):
+    '''Stat one recording index and summarise its timestamps.'''
+    stat = os.stat(path)
+    info = {
+        'path': path,
+        'bytes': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'recordings': 0,
+        'start': None,
+        'end': None,
+        'days': {},
+        'gaps': [],
+    }
+
+    with h5py.File(path, 'r') as f:
+        dataset = f['recording_index']
+        info['recordings'] = int(dataset.shape[0])
+        if not dataset.shape[0]:
+            return info
+        timestamps = np.sort(dataset.fields('timestamp')[:])
+
+    info['start'] = float(timestamps[0])
+    info['end'] = float(timestamps[-1])
+
+    days, counts = np.unique(timestamps // 86400, return_counts=True)
+    info['days'] = {
+        pd.Timestamp(day * 86400, unit='s').strftime('%Y-%m-%d'): int(count)
+        for day, count in zip(days, counts)
+    }
+
+    breaks = np.flatnonzero(np.diff(timestamps) > GAP_SECONDS)
+    info['gaps'] = [[float(timestamps[i]), float(timestamps[i + 1])] for i in breaks]
+
+    return info
+
+def scan(year, processes=None, manifest_path=None):
+    '''Build or refresh the manifest of every node's recording index for a year.
+
+    Only index files whose size or mtime changed since the last scan are
+    opened again; the rest come from the cached manifest.
+    '''
+    index_dir = INDEX_DIR.format(year=year)
+    manifest_path = manifest_path or MANIFEST_PATH.format(year=year)
+
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    current = {}
+    stale = []
+    for name in sorted(os.listdir(index_dir)):
+        if not name.endswith('_recording_index.h5'):
+            continue
+        node = name.split('_')[0]
+        path = index_dir + name
+        stat = os.stat(path)
+        known = manifest.get(node)
+        if known is not None and (known['bytes'], known['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            current[node] = known
+        else:
+            stale.append((node, path))
+
+    if stale:
+        print(f'scanning {len(stale)} of {len(stale) + len(current)} recording indices for {year}')
+        with futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            for (node, _), info in zip(stale, executor.map(describe_index, [path for _, path in stale])):
+                current[node] = info
+
+        os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(current, f)
+        os.replace(tmp_path, manifest_path)
+
+    return current
+
+def summary(manifest):
+    '''One row per node: size, recording count, time coverage and longest gap.'''
+    rows = []
+    for node, info in manifest.items():
+        gaps = [end - start for start, end in info['gaps']]
+        rows.append({
+            'node': node,
+            'bytes': info['bytes'],
+            'recordings': info['recordings'],
+            'start': pd.to_datetime(info['start'], unit='s') if info['start'] is not None else pd.NaT,
+            'end': pd.to_datetime(info['end'], unit='s') if info['end'] is not None else pd.NaT,
+            'days': len(info['days']),
+            'longest_gap[h]': max(gaps) / 3600 if gaps else 0.0,
+        })
+    return pd.DataFrame(rows, columns=['node', 'bytes', 'recordings', 'start', 'end', 'days', 'longest_gap[h]'])
+
+def coverage(info, start, end):
+    '''Fraction of days in [start, end) on which the node recorded anything.'''
+    days = pd.date_range(start, end, freq='D', inclusive='left').strftime('%Y-%m-%d')
+    if not len(days):
+        return 0.0
+    return sum(day in info['days'] for day in days) / len(days)
+
+def select_nodes(year, min_bytes=0, min_recordings=0, start=None, end=None, min_coverage=0.0, processes=None):
+    '''Return the sorted nodes with an index for year that pass every filter.
+
+    min_coverage is the fraction of days in [start, end) (default: the whole
+    year) on which the node has at least one recording.
+    '''
+    manifest = scan(year, processes)
+    start = start or f'{year}-01-01'
+    end = end or f'{year + 1}-01-01'
+
+    return sorted(
+        node for node, info in manifest.items()
+        if info['bytes'] >= min_bytes
+        and info['recordings'] >= min_recordings
+        and (min_coverage <= 0 or coverage(info, start, end) >= min_coverage)
+    )
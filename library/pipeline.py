@@ -0,0 +1,187 @@
+import glob
+import hashlib
+import json
+import os
+import subprocess
+import time
+
+STATE_PATH = '../data/.pipeline-state.json'
+
+# files larger than this, or under one of STAT_ROOTS (the mounted SONYC
+# data, e.g. the recording indices), are identified by their mtime and size
+# instead of a hash of their content, which would read them over the network
+MAX_HASH_BYTES = 2**28
+STAT_ROOTS = ('../sonyc/',)
+
+
+class Task:
+    '''A pipeline stage with declared inputs and outputs.
+
+    A plain task runs `command` (an argv list) once. A partitioned task
+    instead gets `partitions`, a function returning
+    {key: (command, inputs, outputs)}, and only the stale partitions are
+    rerun. Inputs and outputs are paths or glob patterns. `requires` names
+    upstream tasks explicitly, for inputs that are glob patterns which do
+    not match any upstream output pattern literally.
+    '''
+    def __init__(self, name, command=None, inputs=(), outputs=(), partitions=None, requires=()):
+        self.name = name
+        self.command = command
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.requires = list(requires)
+        self._partitions = partitions
+
+    def partitions(self):
+        if self._partitions is None:
+            return {'': (self.command, self.inputs, self.outputs)}
+        return self._partitions()
+
+    def all_inputs(self):
+        return [path for _, inputs, _ in self.partitions().values() for path in inputs]
+
+    def all_outputs(self):
+        return [path for _, _, outputs in self.partitions().values() for path in outputs]
+
+
+def expand(patterns):
+    '''Return the sorted files matched by a list of paths and glob patterns.'''
+    paths = set()
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            paths.update(glob.glob(pattern))
+        elif os.path.exists(pattern):
+            paths.add(pattern)
+    return sorted(paths)
+
+def outputs_exist(patterns):
+    return all(glob.glob(pattern) if glob.has_magic(pattern) else os.path.exists(pattern) for pattern in patterns)
+
+
+class Pipeline:
+    '''Runs tasks in dependency order, skipping those whose inputs did not change.
+
+    A partition is stale if the content hash of its inputs or its command
+    differ from the last successful run, or if one of its outputs is
+    missing. File hashes are remembered by (mtime, size), so unchanged files
+    are not read again; files under stat_roots are never read. A task's inputs must not be files it rewrites, or
+    it would be stale after every run.
+    '''
+    def __init__(self, tasks, state_path=STATE_PATH, stat_roots=STAT_ROOTS):
+        self.tasks = {task.name: task for task in tasks}
+        self.state_path = state_path
+        self.stat_roots = tuple(os.path.join(os.path.abspath(root), '') for root in stat_roots)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'files': {}, 'tasks': {}}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        known = self.state['files'].get(path)
+        if known is not None and known[:2] == [stat.st_mtime_ns, stat.st_size]:
+            return known[2]
+        if stat.st_size > MAX_HASH_BYTES or os.path.abspath(path).startswith(self.stat_roots):
+            return f'{stat.st_mtime_ns}:{stat.st_size}'
+
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+        self.state['files'][path] = [stat.st_mtime_ns, stat.st_size, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def signature(self, command, inputs):
+        digest = hashlib.sha1(json.dumps(command).encode('utf-8'))
+        for path in expand(inputs):
+            digest.update(f'{path}:{self.file_hash(path)}'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def dependencies(self, name):
+        '''Names of the tasks producing an input of task `name`.'''
+        inputs = set(expand(self.tasks[name].all_inputs())) | set(self.tasks[name].all_inputs())
+        return [
+            other.name for other in self.tasks.values()
+            if other.name != name and (
+                other.name in self.tasks[name].requires
+                or inputs & (set(other.all_outputs()) | set(expand(other.all_outputs())))
+            )
+        ]
+
+    def order(self, names=None):
+        '''Return the requested tasks and everything upstream of them in run order.'''
+        names = list(self.tasks) if not names else names
+        ordered, visiting = [], set()
+
+        def visit(name):
+            if name in ordered:
+                return
+            if name in visiting:
+                raise ValueError(f'dependency cycle through {name}')
+            visiting.add(name)
+            for dependency in self.dependencies(name):
+                visit(dependency)
+            visiting.discard(name)
+            ordered.append(name)
+
+        for name in names:
+            if name not in self.tasks:
+                raise KeyError(f'unknown stage {name}')
+            visit(name)
+        return ordered
+
+    def stale(self, name):
+        '''Return {partition key: (command, signature)} for partitions that need to run.'''
+        done = self.state['tasks'].get(name, {})
+        stale = {}
+        for key, (command, inputs, outputs) in self.task_partitions(name).items():
+            signature = self.signature(command, inputs)
+            if done.get(key) != signature or not outputs_exist(outputs):
+                stale[key] = (command, signature)
+        return stale
+
+    def task_partitions(self, name):
+        return self.tasks[name].partitions()
+
+    def run(self, names=None, force=False, dry_run=False):
+        for name in self.order(names):
+            if force:
+                stale = {
+                    key: (command, self.signature(command, inputs))
+                    for key, (command, inputs, _) in self.task_partitions(name).items()
+                }
+            else:
+                stale = self.stale(name)
+
+            total = len(self.task_partitions(name))
+            if not stale:
+                print(f'[{name}] up to date')
+                continue
+            print(f'[{name}] {len(stale)} of {total} partitions to run')
+
+            for key, (command, signature) in stale.items():
+                label = f'{name}:{key}' if key else name
+                print(f"[{label}] {' '.join(command)}")
+                if dry_run:
+                    continue
+
+                start = time.time()
+                subprocess.run(command, check=True)
+                print(f'[{label}] done in {time.time() - start:.2f} seconds')
+
+                self.state['tasks'].setdefault(name, {})[key] = signature
+                self._save_state()
+
+        if not dry_run:
+            self._save_state()
@@ -0,0 +1,80 @@
+import multiprocessing
+import time
+import traceback
+
+from concurrent import futures
+from time import strftime
+
+_open_files = None
+
+
+def _init_worker(semaphore):
+    global _open_files
+    _open_files = semaphore
+
+def _run_node(func, node, args):
+    '''Run func(*args) for one node, returning (node, result, seconds, error).'''
+    start = time.time()
+    if _open_files is not None:
+        _open_files.acquire()
+    try:
+        return node, func(*args), time.time() - start, None
+    except Exception:
+        return node, None, time.time() - start, traceback.format_exc()
+    finally:
+        if _open_files is not None:
+            _open_files.release()
+
+def run_nodes(func, tasks, processes=None, max_open_files=None):
+    '''Run func(*args) for every (node, args) in tasks on a process pool.
+
+    Results are yielded as (node, result, seconds, error) as soon as each node
+    finishes, so callers can merge them while the rest are still running.
+    An exception in one node is caught and returned as a traceback string in
+    `error` instead of stopping the run. At most max_open_files nodes run func
+    at the same time, which bounds the number of HDF5 files held open.
+    processes=1 runs everything in the calling process.
+    '''
+    tasks = list(tasks.items()) if isinstance(tasks, dict) else list(tasks)
+
+    if processes == 1:
+        for node, args in tasks:
+            yield _report(_run_node(func, node, args))
+        return
+
+    semaphore = None
+    if max_open_files is not None:
+        semaphore = multiprocessing.get_context().BoundedSemaphore(max_open_files)
+
+    with futures.ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(semaphore,)
+    ) as executor:
+        pending = [executor.submit(_run_node, func, node, args) for node, args in tasks]
+        for future in futures.as_completed(pending):
+            yield _report(future.result())
+
+def _report(outcome):
+    node, _, seconds, error = outcome
+    if error is None:
+        print(strftime(f'[%T] {node} done in {seconds:.2f} seconds'))
+    else:
+        print(strftime(f'[%T] {node} failed after {seconds:.2f} seconds'))
+        print(error)
+    return outcome
+
+def collect(outcomes):
+    '''Drain run_nodes into ({node: result}, {node: seconds}, {node: error}).'''
+    results, timings, errors = {}, {}, {}
+    for node, result, seconds, error in outcomes:
+        timings[node] = seconds
+        if error is None:
+            results[node] = result
+        else:
+            errors[node] = error
+
+    if errors:
+        print(f'{len(errors)} of {len(timings)} nodes failed: {", ".join(sorted(errors))}')
+
+    return results, timings, errors
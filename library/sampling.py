@@ -0,0 +1,167 @@
+import glob
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from features import get_features, raise_node_errors
+from matching import write_parquet
+
+# class -> audio-paths table written by the instance-list scripts
+PATHS = {
+    1: '../data/audio-paths-rained.csv',
+    0: '../data/audio-paths-nonrained.csv',
+}
+FEATURE_CACHE = '../cache/features/{feature_set}/{year}/'
+
+
+def columnar_path(csv_path):
+    '''Path of the Parquet copy of an audio-paths table, rebuilt when the csv is newer.
+
+    The copy keeps the rows in csv order and has the node split out of the
+    path, so that it can be filtered on without parsing paths again. The
+    copy the instance-list scripts write with --extra-formats parquet is
+    the same file and is reused; one without a node column is rebuilt.
+    '''
+    parquet_path = os.path.splitext(csv_path)[0] + '.parquet'
+    if (
+        not os.path.exists(parquet_path)
+        or os.path.getmtime(parquet_path) < os.path.getmtime(csv_path)
+        or 'node' not in pq.read_schema(parquet_path).names
+    ):
+        write_parquet(pd.read_csv(csv_path), parquet_path)
+    return parquet_path
+
+def load_instances(max_diff=None, nodes=None, columns=None, classes=(1, 0)):
+    '''Read the audio-paths tables with the filters pushed down to Parquet.
+
+    Rows keep the order of the csv within each class, so DataFrame.sample on
+    one class gives the same rows as on the filtered csv. Adds a 'class'
+    column (1 for rainy, 0 for not rainy).
+    '''
+    filters = []
+    if max_diff is not None:
+        filters += [('diff', '>=', -max_diff), ('diff', '<=', max_diff)]
+    if nodes is not None:
+        filters.append(('node', 'in', list(nodes)))
+
+    frames = [
+        pd.read_parquet(columnar_path(PATHS[label]), columns=columns, filters=filters or None).assign(**{'class': label})
+        for label in classes
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+def sample_keys(df, seed):
+    '''A pseudo-random key per row that only depends on (node, node_timestamp, seed).
+
+    Drawing the rows with the smallest keys makes samples reproducible and
+    nested: a larger sample, or a sample of an overlapping table, contains
+    the same rows wherever it can.
+    '''
+    node_hash = {node: zlib.crc32(node.encode('utf-8')) for node in df['node'].unique()}
+    key = df['node'].map(node_hash).to_numpy(dtype=np.uint64) << np.uint64(32)
+    key ^= df['node_timestamp'].to_numpy(dtype=np.float64).view(np.uint64)
+    key ^= np.uint64(seed % 2**64)
+
+    # splitmix64 finalizer
+    with np.errstate(over='ignore'):
+        key = (key ^ (key >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+        key = (key ^ (key >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+        key ^= key >> np.uint64(31)
+    return key
+
+def allocate(sizes, n):
+    '''Split n draws over strata proportionally to their sizes (largest remainder).'''
+    sizes = np.asarray(sizes)
+    n = min(n, sizes.sum())
+    quota = sizes * n / sizes.sum()
+    counts = np.floor(quota).astype(np.int64)
+    remainder = n - counts.sum()
+    counts[np.argsort(-(quota - counts), kind='stable')[:remainder]] += 1
+    return counts
+
+def stratified_sample(df, n, seed, strata=('class', 'node', 'hour')):
+    '''Draw n rows of df, spread over strata in proportion to their size.
+
+    'hour' is the hour of day of node_timestamp. Rows are drawn by their
+    sample_keys, so the same seed always gives the same rows. The sample is
+    returned in key order, i.e. already shuffled.
+    '''
+    df = df.assign(_key=sample_keys(df, seed))
+    if 'hour' in strata and 'hour' not in df:
+        df['hour'] = (df['node_timestamp'].to_numpy() // 3600 % 24).astype(np.int64)
+
+    if strata:
+        groups = df.groupby(list(strata), sort=True).indices
+        counts = allocate([len(rows) for rows in groups.values()], n)
+        key = df['_key'].to_numpy()
+        chosen = [
+            rows[np.argsort(key[rows], kind='stable')[:count]]
+            for rows, count in zip(groups.values(), counts) if count
+        ]
+        df = df.iloc[np.concatenate(chosen)] if chosen else df.iloc[:0]
+    else:
+        df = df.nsmallest(n, '_key')
+
+    return df.sort_values('_key', kind='stable').drop(columns='_key').reset_index(drop=True)
+
+
+def cached_features(df, feature_set, year=2017, cache_dir=None, return_errors=False, **kwargs):
+    '''get_features, reusing rows extracted for earlier samples.
+
+    Features are kept per (node, node_timestamp) in Parquet part files under
+    cache_dir; only the rows of df not found there are read from the feature
+    stores, and they are added as a new part. The rows of nodes that were
+    read are cached even if other nodes fail, so running it again only
+    retries the failed nodes. Failures are handled as in get_features
+    (raise, or return (features, errors) with return_errors). kwargs go to
+    get_features.
+    '''
+    cache_dir = cache_dir or FEATURE_CACHE.format(feature_set=feature_set, year=year)
+    keys = df[['node', 'node_timestamp']]
+
+    parts = sorted(glob.glob(os.path.join(cache_dir, 'part-*.parquet')))
+    cached = None
+    if parts:
+        cached = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+        cached = cached.drop_duplicates(['node', 'node_timestamp'])
+
+    if cached is not None:
+        known = keys.merge(cached[['node', 'node_timestamp']], how='left', indicator=True)['_merge'] == 'both'
+        known = known.to_numpy()
+    else:
+        known = np.zeros(len(df), dtype=bool)
+    print(f'{known.sum()} of {len(df)} rows of {feature_set} features cached')
+
+    errors = {}
+    missing = keys[~known].drop_duplicates()
+    if len(missing):
+        extracted, errors = get_features(missing, feature_set, year, return_errors=True, **kwargs)
+        new = pd.concat([missing.loc[extracted.index], extracted], axis=1)
+        for column in extracted.columns:
+            # vector features such as spl_vector are stored as lists
+            if new[column].dtype == object:
+                new[column] = new[column].map(list)
+
+        if len(new):
+            os.makedirs(cache_dir, exist_ok=True)
+            part_path = os.path.join(cache_dir, f'part-{len(parts):05d}.parquet')
+            new.to_parquet(part_path + '.tmp', index=False)
+            os.replace(part_path + '.tmp', part_path)
+            cached = new if cached is None else pd.concat([cached, new], ignore_index=True)
+
+    if errors and not return_errors:
+        raise_node_errors(feature_set, errors)
+    if cached is None:
+        return get_features(df, feature_set, year, return_errors=return_errors, **kwargs)
+
+    # rows without features are left out, like get_features does
+    features = keys.merge(cached, how='left', indicator=True)
+    features.index = df.index
+    features = features[features['_merge'] == 'both'].drop(columns=['node', 'node_timestamp', '_merge'])
+    for column in features.columns:
+        if features[column].dtype == object:
+            features[column] = features[column].map(np.asarray)
+    return (features, errors) if return_errors else features
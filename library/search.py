@@ -0,0 +1,196 @@
+import hashlib
+import json
+import math
+import os
+import time
+
+from concurrent import futures
+
+import numpy as np
+import pandas as pd
+
+from sklearn.base import clone, is_classifier
+from sklearn.metrics import check_scoring
+from sklearn.model_selection import ParameterGrid, check_cv
+
+SEARCH_CACHE = '../cache/search/'
+
+_data = None
+
+
+def _init_worker(X, y, cv, scoring):
+    # the data and folds are sent to each worker once instead of with every task
+    global _data
+    _data = (X, y, list(cv.split(X, y)), scoring)
+
+def _fit_fold(estimator, params, fold):
+    X, y, splits, scoring = _data
+    train, test = splits[fold]
+    model = clone(estimator).set_params(**params)
+
+    start = time.time()
+    model.fit(X[train], y[train])
+    fit_time = time.time() - start
+
+    start = time.time()
+    score = check_scoring(model, scoring)(model, X[test], y[test])
+    return {'score': float(score), 'fit_time': fit_time, 'score_time': time.time() - start}
+
+def data_key(X, y, cv, scoring=None):
+    '''Hash of the training data, the folds and the scoring.'''
+    digest = hashlib.sha1()
+    for array in (np.asarray(X), np.asarray(y)):
+        array = np.ascontiguousarray(array)
+        digest.update(f'{array.shape}{array.dtype.str}'.encode('utf-8'))
+        digest.update(array.tobytes())
+    digest.update(f'{cv!r}:{scoring!r}'.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def fold_key(estimator, params, fold):
+    all_params = {**estimator.get_params(deep=False), **params}
+    description = f'{type(estimator).__name__}:{sorted(all_params.items())!r}:{fold}'
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+class FoldCache:
+    '''Scores and fit times of single (params, fold) fits, one json file each.
+
+    Entries live under a directory named by data_key, so changing the data,
+    the folds or the scoring never reuses an old score.
+    '''
+    def __init__(self, cache_dir, key):
+        self.path = os.path.join(cache_dir, key)
+        os.makedirs(self.path, exist_ok=True)
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.path, f'{key}.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, result):
+        path = os.path.join(self.path, f'{key}.json')
+        tmp_path = path + f'.{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, path)
+
+
+def evaluate(estimator, candidates, X, y, cv=5, scoring=None, processes=None, cache_dir=SEARCH_CACHE):
+    '''Cross-validate every parameter dict in candidates, reusing cached folds.
+
+    Folds that are not cached are fit on a pool of `processes` workers.
+    Returns one row per candidate with its params, per-fold and mean test
+    scores, and `seconds`, the fit plus score time spent on it.
+    '''
+    X, y = np.asarray(X), np.asarray(y)
+    cv = check_cv(cv, y, classifier=is_classifier(estimator))
+    n_folds = cv.get_n_splits(X, y)
+    cache = FoldCache(cache_dir, data_key(X, y, cv, scoring))
+
+    results = {}
+    todo = []
+    for i, params in enumerate(candidates):
+        for fold in range(n_folds):
+            key = fold_key(estimator, params, fold)
+            result = cache.get(key)
+            if result is None:
+                todo.append((i, fold, key))
+            else:
+                results[i, fold] = result
+    print(f'{len(todo)} of {len(candidates) * n_folds} fits to run, the rest are cached')
+
+    start = time.time()
+    if todo and processes == 1:
+        _init_worker(X, y, cv, scoring)
+        for i, fold, key in todo:
+            results[i, fold] = _fit_fold(estimator, candidates[i], fold)
+            cache.put(key, results[i, fold])
+    elif todo:
+        with futures.ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(X, y, cv, scoring)
+        ) as executor:
+            pending = {
+                executor.submit(_fit_fold, estimator, candidates[i], fold): (i, fold, key)
+                for i, fold, key in todo
+            }
+            for future in futures.as_completed(pending):
+                i, fold, key = pending[future]
+                results[i, fold] = future.result()
+                cache.put(key, results[i, fold])
+    if todo:
+        print(f'{len(todo)} fits done in {time.time() - start:.2f} seconds')
+
+    rows = []
+    for i, params in enumerate(candidates):
+        folds = [results[i, fold] for fold in range(n_folds)]
+        scores = [fold['score'] for fold in folds]
+        row = {'params': params, 'mean_test_score': np.mean(scores), 'std_test_score': np.std(scores)}
+        row.update({f'split{fold}_test_score': score for fold, score in enumerate(scores)})
+        row['mean_fit_time'] = np.mean([fold['fit_time'] for fold in folds])
+        row['seconds'] = sum(fold['fit_time'] + fold['score_time'] for fold in folds)
+        rows.append(row)
+
+    results = pd.DataFrame(rows)
+    results['rank_test_score'] = results['mean_test_score'].rank(ascending=False, method='min').astype(int)
+    return results
+
+
+class SearchResult:
+    '''The outcome of grid_search or halving_search, with GridSearchCV-like attributes.'''
+    def __init__(self, results, estimator, X, y, refit=True):
+        self.results_ = results
+        best = results['mean_test_score'].idxmax()
+        self.best_params_ = results.at[best, 'params']
+        self.best_score_ = results.at[best, 'mean_test_score']
+        self.best_estimator_ = None
+        if refit:
+            self.best_estimator_ = clone(estimator).set_params(**self.best_params_).fit(X, y)
+
+    def predict(self, X):
+        return self.best_estimator_.predict(X)
+
+
+def grid_search(estimator, param_grid, X, y, cv=5, scoring=None, processes=None, refit=True, cache_dir=SEARCH_CACHE):
+    '''Exhaustive search over param_grid, like GridSearchCV, but parallel and cached.
+
+    Every (params, fold) fit is cached on disk, so rerunning the search, or
+    running it again with values added to the grid, only fits the new
+    combinations.
+    '''
+    candidates = list(ParameterGrid(param_grid))
+    results = evaluate(estimator, candidates, X, y, cv, scoring, processes, cache_dir)
+    return SearchResult(results, estimator, X, y, refit)
+
+def halving_search(estimator, param_grid, X, y, factor=3, min_samples=None, cv=5, scoring=None,
+                   processes=None, refit=True, seed=0, cache_dir=SEARCH_CACHE):
+    '''Successive halving: score all candidates on a small sample, keep the best 1/factor, grow the sample.
+
+    Samples are prefixes of one seeded permutation of the rows, and the last
+    round uses all of them. The results have one row per candidate and
+    round, with the round and its number of samples.
+    '''
+    X, y = np.asarray(X), np.asarray(y)
+    candidates = list(ParameterGrid(param_grid))
+    rounds = max(1, math.ceil(math.log(len(candidates), factor)))
+    permutation = np.random.RandomState(seed).permutation(len(y))
+    min_samples = min_samples or max(len(y) // factor ** (rounds - 1), 1)
+
+    frames = []
+    for step in range(rounds):
+        n_samples = len(y) if step == rounds - 1 else min(len(y), min_samples * factor ** step)
+        rows = np.sort(permutation[:n_samples])
+        print(f'round {step}: {len(candidates)} candidates on {n_samples} samples')
+
+        results = evaluate(estimator, candidates, X[rows], y[rows], cv, scoring, processes, cache_dir)
+        frames.append(results.assign(round=step, n_samples=n_samples))
+
+        keep = max(1, math.ceil(len(candidates) / factor))
+        candidates = list(results.nsmallest(keep, 'rank_test_score')['params'])
+
+    result = SearchResult(frames[-1], estimator, X, y, refit)
+    result.results_ = pd.concat(frames, ignore_index=True)
+    return result
@@ -1,90 +1,286 @@
 import base64
+import collections
 import h5py
+import numpy as np
 import os
 import pandas as pd
 import sys
 
-sys.path.append('/'.join(os.getcwd().split('/')[:-1]))
-from private.decrypt import readEncryptedTarAudioFile
+import audio
+
+from index_cache import load_index
+
+INDEX_ROOT = '../sonyc/indices/'
+INDEX_PATH = INDEX_ROOT + '{year}/{node}_recording_index.h5'
+AUDIO_PATH = '../sounds/{year}/{node}/'
+
+# the repository root, which holds private/decrypt.py
+PRIVATE_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# sorted indices kept per process; each holds two int64/float64 columns of a
+# node's year, so the oldest are dropped past this many
+MAX_CACHED_INDICES = 16
+
+_read_encrypted = None
+_indices = collections.OrderedDict()
+_handles = {}
+_pid = None
+
+
+def decrypt_backend():
+    '''private.decrypt.readEncryptedTarAudioFile, imported the first time audio is read.'''
+    global _read_encrypted
+    if _read_encrypted is None:
+        if PRIVATE_ROOT not in sys.path:
+            sys.path.append(PRIVATE_ROOT)
+        from private.decrypt import readEncryptedTarAudioFile as _read_encrypted
+    return _read_encrypted
+
+def readEncryptedTarAudioFile(path, index):
+    # a module-level stand-in, so that it can be pickled to workers before
+    # the decrypt backend has been imported anywhere
+    return decrypt_backend()(path, index)
+
+def _check_fork():
+    # h5py handles must not be shared with a forked child; it opens its own
+    global _pid
+    if _pid != os.getpid():
+        _handles.clear()
+        _pid = os.getpid()
+
+def sorted_index(node, year):
+    '''The cached index columns of a node's year and their timestamp order, shared within the process.
+
+    Returns (index, order, epochs) where epochs are the sorted timestamps
+    and order maps them back to index rows. An entry is rebuilt when the
+    index file changes on disk.
+    '''
+    key = (node, year)
+    stat = os.stat(INDEX_PATH.format(year=year, node=node))
+    if key in _indices and _indices[key][0] == (stat.st_mtime_ns, stat.st_size):
+        _indices.move_to_end(key)
+        return _indices[key][1]
+
+    # timestamp, day_hdf5_path and day_h5_index come from the local index
+    # cache; read the timestamp column once and keep it sorted so that
+    # interval queries are a binary search instead of a scan over the year
+    index = load_index(INDEX_PATH.format(year=year, node=node))
+    timestamps = index['timestamp']
+    order = np.argsort(timestamps, kind='stable')
+    _indices[key] = ((stat.st_mtime_ns, stat.st_size), (index, order, np.ascontiguousarray(timestamps[order])))
+    _indices.move_to_end(key)
+
+    while len(_indices) > MAX_CACHED_INDICES:
+        _indices.popitem(last=False)
+    return _indices[key][1]
+
+def index_handle(node, year):
+    '''The recording_index dataset of a node's year, opened once per process.'''
+    _check_fork()
+    key = (node, year)
+    if key not in _handles:
+        _handles[key] = h5py.File(INDEX_PATH.format(year=year, node=node), 'r')['recording_index']
+    return _handles[key]
+
+def close_handle(node, year):
+    _check_fork()
+    dataset = _handles.pop((node, year), None)
+    if dataset is not None:
+        dataset.file.close()
 
 def convert_to_epoch(stamp):
     return (stamp - pd.Timestamp('1970-01-01')) // pd.Timedelta('1s')
 
-# NOT FOR USE
-def save_file(arg):
-    path, index, audio_path, audio_key = arg
-    fname = path + f'{index}.mp3'
-    sound_data = base64.decodebytes(
-        readEncryptedTarAudioFile(
-            '../sonyc/' + audio_path,
-            audio_key
-        )
+def available_years(node):
+    '''Years with a recording index for node, in order.'''
+    return sorted(
+        int(year) for year in os.listdir(INDEX_ROOT)
+        if year.isdigit() and os.path.exists(INDEX_PATH.format(year=year, node=node))
     )
 
-    with open(fname, 'wb') as f:
-        f.write(sound_data)
-
 class Searcher:
-    def __init__(self, node, year=2017):
+    '''Interval and audio queries on one node's recording index for a year.
+
+    The sorted index and the h5py handle behind self.information are shared
+    by every Searcher of the same node and year in a process. A Searcher
+    pickles as its node and year and reattaches to the unpickling process's
+    cache, so it can be sent to pool workers. With read_only=True the
+    decrypt backend is never imported and the audio methods raise.
+    '''
+    def __init__(self, node, year=2017, read_only=False):
         self.node = node
+        self.year = year
+        self.read_only = read_only
+        
+        self.local_audio_path = AUDIO_PATH.format(year=year, node=node)
+        self.index_path = INDEX_PATH.format(year=year, node=node)
+        self.index, self.order, self.epochs = sorted_index(node, year)
         
-        self.local_audio_path = f'../sounds/{year}/{node}/'
+    def __getstate__(self):
+        return {'node': self.node, 'year': self.year, 'read_only': self.read_only}
+    
+    def __setstate__(self, state):
+        self.__init__(**state)
+        
+    @property
+    def information(self):
+        # the full h5 dataset is only opened when it is used
+        return index_handle(self.node, self.year)
+    
+    def close(self):
+        close_handle(self.node, self.year)
         
-        index_path = f'../sonyc/indices/{year}/{node}_recording_index.h5'
-        self.information = h5py.File(index_path, 'r')['recording_index']
-        self.timestamps = pd.DataFrame(self.information['timestamp'], columns=['epoch'])
+    def interval_bounds(self, starts, stops):
+        '''Return [lo, hi) positions into self.epochs for each (start, stop) window.'''
+        starts = np.asarray(starts)
+        stops = np.asarray(stops)
+        lo = np.searchsorted(self.epochs, starts, side='left')
+        hi = np.searchsorted(self.epochs, stops, side='left')
+        return lo, np.maximum(lo, hi)
         
     def return_interval(self, start, stop=None):
         if stop is None:
             stop = start + pd.Timedelta(minutes=60)
             
-        lower_bound = convert_to_epoch(start) <= self.timestamps['epoch']
-        upper_bound = self.timestamps['epoch'] < convert_to_epoch(stop)
+        lo, hi = self.interval_bounds(convert_to_epoch(start), convert_to_epoch(stop))
+        
+        return self._interval_frame(np.arange(lo, hi))
+    
+    def return_intervals(self, starts, stops=None):
+        '''Vectorized return_interval over many windows.
+        
+        The result has one row per matched recording and a 'window' column
+        holding the position of the (start, stop) pair it fell into.
+        '''
+        starts = pd.DatetimeIndex(starts)
+        if stops is None:
+            stops = starts + pd.Timedelta(minutes=60)
+        else:
+            stops = pd.DatetimeIndex(stops)
+            
+        lo, hi = self.interval_bounds(convert_to_epoch(starts), convert_to_epoch(stops))
+        counts = hi - lo
+        
+        window = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
         
-        interval = self.timestamps[lower_bound & upper_bound].reset_index()
-        interval['utc'] = pd.to_datetime(
-            interval['epoch'], 
-            unit='s', 
-            utc=True, 
-            infer_datetime_format=True
-        )
+        interval = self._interval_frame(np.repeat(lo, counts) + offsets)
+        interval['window'] = window
         
         return interval
     
+    def _interval_frame(self, positions):
+        interval = pd.DataFrame({
+            'index': self.order[positions],
+            'epoch': self.epochs[positions],
+        })
+        interval['utc'] = pd.to_datetime(interval['epoch'], unit='s', utc=True)
+        
+        return interval
+    
+    def _check_audio(self):
+        if self.read_only:
+            raise RuntimeError(f'Searcher for {self.node} {self.year} is read-only and cannot read audio')
+        
     def get_audio(self, index):
-        information = self.information[index]
-        audio_path = '../sonyc/' + information[1].decode('utf-8')
-        return base64.decodebytes(readEncryptedTarAudioFile(audio_path, information[2]))
+        self._check_audio()
+        audio_path = '../sonyc/' + self.index['day_hdf5_path'][index].decode('utf-8')
+        return base64.decodebytes(decrypt_backend()(audio_path, self.index['day_h5_index'][index]))
+    
+    def iter_audio(self, indices):
+        '''Yield (index, audio) for many recordings, grouped by day archive.'''
+        self._check_audio()
+        return audio.iter_audio(self.index, indices, readEncryptedTarAudioFile)
+    
+    def save_audio_by_day(self, day, processes=None):
+        self._check_audio()
+        # imported here because exporter builds on this module
+        from exporter import export_audio
+        return export_audio([self], [day], processes=processes)
+
+
+class MultiYearSearcher:
+    '''Searcher over every year a node has a recording index for.
+
+    A Searcher is only created for the years a query touches, and at most
+    `max_open` of them are kept; the least recently used one is closed when
+    another year is needed. Result frames have a 'year' column next to
+    'index', which get_audio and iter_audio use to read from the right file.
+    Like Searcher it can be pickled, and read_only is passed on to it.
+    '''
+    def __init__(self, node, years=None, max_open=2, read_only=False):
+        self.node = node
+        self.years = sorted(available_years(node) if years is None else years)
+        self.max_open = max_open
+        self.read_only = read_only
+        self._searchers = collections.OrderedDict()
+        
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_searchers'] = collections.OrderedDict()
+        return state
+        
+    def searcher(self, year):
+        if year not in self.years:
+            raise KeyError(f'{self.node} has no recording index for {year}')
+        
+        s = self._searchers.pop(year, None)
+        if s is None:
+            s = Searcher(self.node, year, self.read_only)
+        self._searchers[year] = s
+        
+        while len(self._searchers) > self.max_open:
+            _, evicted = self._searchers.popitem(last=False)
+            evicted.close()
+        return s
+    
+    def close(self):
+        for s in self._searchers.values():
+            s.close()
+        self._searchers.clear()
+        
+    def years_between(self, start, stop):
+        '''Years whose index may hold recordings in [start, stop).'''
+        # an index can hold a few recordings from just across New Year's,
+        # so the neighbouring year is searched too near the boundary
+        first = (pd.Timestamp(start) - pd.Timedelta('1d')).year
+        last = (pd.Timestamp(stop) + pd.Timedelta('1d')).year
+        return [year for year in self.years if first <= year <= last]
     
-    def save_audio_by_day(self, day):
-        path = self.local_audio_path + f'{day}/'
-        if os.path.exists(path):
-            print('directory already exists')
-            return
+    def return_interval(self, start, stop=None):
+        if stop is None:
+            stop = start + pd.Timedelta(minutes=60)
+        
+        frames = [
+            self.searcher(year).return_interval(start, stop).assign(year=year)
+            for year in self.years_between(start, stop)
+        ]
+        return self._merge(frames, ['epoch'])
+    
+    def return_intervals(self, starts, stops=None):
+        starts = pd.DatetimeIndex(starts)
+        if stops is None:
+            stops = starts + pd.Timedelta(minutes=60)
         else:
-            os.makedirs(path)
-            
-        today = pd.Timestamp(day)
-        next_day = today + pd.Timedelta('1d')
-        
-        interval = self.return_interval(today, next_day)
-        
-        N = len(interval.index)
-        print(f'{N} files to save')
-        for count, index in enumerate(interval.index):
-            print(count)
-            fname = path + f'{index}.mp3'
-            audio_path = self.information[index][1].decode('utf-8')
-            audio_key = self.information[index][2]
-            sound_data = base64.decodebytes(
-                readEncryptedTarAudioFile(
-                    '../sonyc/' + audio_path,
-                    audio_key
-                )
-            )
-
-            with open(fname, 'wb') as f:
-                f.write(sound_data)
-                
-            if (count+1) % 100 == 0:
-                print(f'{count+1} of {N} files saved')
\ No newline at end of file
+            stops = pd.DatetimeIndex(stops)
+        if not len(starts):
+            return self._merge([], ['window', 'epoch'])
+        
+        years = sorted(set().union(*(self.years_between(start, stop) for start, stop in zip(starts, stops))))
+        frames = [self.searcher(year).return_intervals(starts, stops).assign(year=year) for year in years]
+        return self._merge(frames, ['window', 'epoch'])
+    
+    def _merge(self, frames, by):
+        if not frames:
+            return pd.DataFrame(columns=['index', 'epoch', 'utc'] + by[:-1] + ['year'])
+        interval = pd.concat(frames, ignore_index=True)
+        return interval.sort_values(by, kind='stable').reset_index(drop=True)
+    
+    def get_audio(self, index, year):
+        return self.searcher(year).get_audio(index)
+    
+    def iter_audio(self, interval):
+        '''Yield (year, index, audio) for the rows of a return_interval(s) frame.'''
+        for year, group in interval.groupby('year', sort=True):
+            for index, data in self.searcher(year).iter_audio(group['index'].to_numpy()):
+                yield year, index, data
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+strategies = ('midpoint', 'linear', 'ffill', 'zero')
+
+
+def gap_bounds(values):
+    '''Return, for every row, the positions of the previous and next observed rows.
+
+    Rows before the first or after the last observation get -1 / len(values).
+    '''
+    n = len(values)
+    positions = np.arange(n)
+    observed = ~np.isnan(values)
+
+    prev_obs = np.maximum.accumulate(np.where(observed, positions, -1))
+    next_obs = np.minimum.accumulate(np.where(observed, positions, n)[::-1])[::-1]
+
+    return prev_obs, next_obs
+
+def fill_gaps(values, strategy='midpoint'):
+    '''Fill NaN gaps in a series of observations in one vectorized pass.
+
+    Strategies:
+    - 'midpoint': the first half of a gap takes the value before it and the
+      second half the value after it (the extra row of an odd gap goes to the
+      first half). A single missing row between two different values gets
+      their mean.
+    - 'linear': linear interpolation between the values around the gap.
+    - 'ffill': carry the last observation forward.
+    - 'zero': treat missing values as 0.
+
+    Except for 'zero', rows before the first observation take its value and
+    rows after the last observation take that one.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+
+    if strategy == 'zero':
+        return np.where(missing, 0.0, values)
+    if strategy not in strategies:
+        raise ValueError(f'unknown gap filling strategy {strategy}')
+    if missing.all():
+        raise ValueError('no observed values to fill gaps from')
+
+    n = len(values)
+    prev_obs, next_obs = gap_bounds(values)
+
+    # leading and trailing gaps are filled from their only neighbour
+    prev_obs = np.where(prev_obs < 0, next_obs, prev_obs)
+    next_obs = np.where(next_obs >= n, prev_obs, next_obs)
+
+    init = values[prev_obs]
+    final = values[next_obs]
+
+    if strategy == 'ffill':
+        filled = init
+    else:
+        gap = next_obs - prev_obs - 1
+        offset = np.arange(n) - prev_obs - 1
+
+        if strategy == 'linear':
+            fraction = (offset + 1) / np.maximum(gap + 1, 1)
+            filled = init + (final - init) * fraction
+        else:
+            filled = np.where(offset < (gap + 1) // 2, init, final)
+            filled = np.where(gap == 1, (init + final) / 2, filled)
+            filled = np.where(init == final, init, filled)
+
+    return np.where(missing, filled, values)
+
+def parse_precip(precip_col):
+    '''The raw 'p01m' column as floats: trace values ('T') are 0.00 and missing ones ('M') NaN.'''
+    return pd.to_numeric(precip_col.mask(precip_col == 'T', '0.00').mask(precip_col == 'M'))
+
+def clean_precip_col(df, strategy):
+    '''Parse the 'p01m' column of a raw weather frame in place, filling missing values with strategy.'''
+    precip_col = df['p01m']
+
+    # Replace trace values, T, with 0.00
+    precip_t_count = precip_col[precip_col == 'T'].count()
+    if precip_t_count > 0:
+        print(f"{precip_t_count} trace values in 'p01m' column")
+
+    # Fill missing values, M, according to strategy
+    precip_m_count = precip_col[precip_col == 'M'].count()
+    if precip_m_count > 0:
+        print(f"{precip_m_count} missing values in 'p01m' column, filled with {strategy}")
+
+    df['p01m'] = fill_gaps(parse_precip(precip_col).to_numpy(dtype=float), strategy)
@@ -1,3 +1,4 @@
+import argparse
 import os
 
 from time import strftime
@@ -6,37 +7,80 @@ import h5py
 import numpy as np
 import pandas as pd
 
+from runner import collect, run_nodes
+
 SONYC_PATH = '/beegfs/work/sonyc/'
-OPEN_L3 = 'features/openl3/2017/'
+OPEN_L3 = 'features/openl3/{year}/'
 
-node_paths = os.listdir(SONYC_PATH + OPEN_L3)
+# number of nodes processed at the same time, and how many of them may hold
+# their feature file open at once
+PROCESSES = int(os.environ.get('SLURM_CPUS_PER_TASK', 1))
+MAX_OPEN_FILES = PROCESSES
 
-rainy_df = pd.read_csv('data/audio-paths-rained.csv')
-nonrainy_df = pd.read_csv('data/audio-paths-nonrained.csv')
+# at most CHUNK_ROWS embeddings are held in memory per node; gaps of up to
+# MAX_GAP rows between wanted rows are read and thrown away rather than
+# starting a new read
+CHUNK_ROWS = 256
+MAX_GAP = 16
 
-rainy_nodes = rainy_df['path'].map(lambda _: _.split('/')[2])
-nonrainy_nodes = nonrainy_df['path'].map(lambda _: _.split('/')[2])
+def coalesce(indices, max_gap=MAX_GAP):
+    '''Split sorted row indices into (start, stop) runs, bridging small gaps.'''
+    if not len(indices):
+        return []
+    breaks = np.flatnonzero(np.diff(indices) > max_gap + 1) + 1
+    starts = indices[np.r_[0, breaks]]
+    stops = indices[np.r_[breaks - 1, len(indices) - 1]] + 1
+    return list(zip(starts, stops))
 
-node_set = set(rainy_nodes) & set(nonrainy_nodes)
+def iter_rows(dataset, indices, chunk_rows=CHUNK_ROWS, max_gap=MAX_GAP):
+    '''Yield the rows of dataset at sorted indices, never reading more than chunk_rows at once.'''
+    for start, stop in coalesce(indices, max_gap):
+        for lo in range(start, stop, chunk_rows):
+            hi = min(lo + chunk_rows, stop)
+            wanted = indices[np.searchsorted(indices, lo):np.searchsorted(indices, hi)]
+            if len(wanted):
+                yield dataset[lo:hi][wanted - lo]
 
-for i, node_path in enumerate(node_paths):
-    node = node_path.split('_')[0]
+def write_rows(write_file, name, dataset, indices, chunk_rows=CHUNK_ROWS):
+    '''Copy the rows at indices into a new chunked, compressed dataset.'''
+    out = write_file.create_dataset(
+        name,
+        shape=(len(indices),),
+        dtype=dataset.dtype,
+        chunks=(max(1, min(chunk_rows, len(indices))),),
+        compression='gzip'
+    )
+    written = 0
+    for rows in iter_rows(dataset, indices, chunk_rows):
+        out[written:written+len(rows)] = rows
+        written += len(rows)
 
-    print(strftime(f'[%T] On node {node}'))
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--year',
+        type=int,
+        default=2017,
+        help='year of the OpenL3 features, and of the instance lists in data/'
+    )
 
-    rainy_matches = rainy_df[rainy_nodes == node]['node_timestamp'].values
-    nonrainy_matches = nonrainy_df[nonrainy_nodes == node]['node_timestamp'].values
+    return parser.parse_args()
 
-    if not rainy_matches.any() or not nonrainy_matches.any():
-        print(strftime('[%T] No matches found for this node'))
-        continue
+def extract_node(node_path, rainy_matches, nonrainy_matches, year):
+    node = node_path.split('_')[0]
 
-    feature_path = SONYC_PATH + OPEN_L3 + node_path
+    output_path = os.getcwd() + f'/nodes/{year}/{node}-features.h5'
+    if os.path.exists(output_path):
+        print(strftime(f'[%T] {node}-features.h5 already exists, skipping'))
+        with h5py.File(output_path, 'r') as done_file:
+            return len(done_file['rainy']) + len(done_file['nonrainy'])
+
+    feature_path = SONYC_PATH + OPEN_L3.format(year=year) + node_path
     with h5py.File(feature_path, 'r') as feature_file:
-        print(strftime('[%T] Extracting feature'))
-        
+        print(strftime(f'[%T] Extracting feature for {node}'))
+
         timestamps = feature_file['openl3']['timestamp']
-	
+
         xy_rainy, feature_rainy_ind, rainy_ind = np.intersect1d(
             timestamps,
             rainy_matches,
@@ -48,18 +92,49 @@ for i, node_path in enumerate(node_paths):
             return_indices=True
         )
 
-        if not any(feature_rainy_ind) or not any(feature_nonrainy_ind):
-            print(strftime('[%Y] No overlap found for this node'))
-            continue
+        if not len(feature_rainy_ind) or not len(feature_nonrainy_ind):
+            print(strftime(f'[%T] No overlap found for {node}'))
+            return 0
 
-        with h5py.File(os.getcwd() + f'/nodes/{node}-features.h5', 'w') as write_file:
+        # write to a partial file and rename it when done, so that a
+        # preempted job can be rerun and skips the nodes that finished
+        partial_path = output_path + '.partial'
+        with h5py.File(partial_path, 'w') as write_file:
             print(strftime(f'[%T] Creating {node}-features.h5 file'))
 
-            write_file.create_dataset(
-                'rainy',
-                data=feature_file['openl3'][list(np.sort(feature_rainy_ind))]
-            )
-            write_file.create_dataset(
-                'nonrainy',
-                data=feature_file['openl3'][list(np.sort(feature_nonrainy_ind))]
-            )
+            write_rows(write_file, 'rainy', feature_file['openl3'], np.sort(feature_rainy_ind))
+            write_rows(write_file, 'nonrainy', feature_file['openl3'], np.sort(feature_nonrainy_ind))
+
+        os.replace(partial_path, output_path)
+
+    return len(feature_rainy_ind) + len(feature_nonrainy_ind)
+
+def main():
+    args = get_args()
+    node_paths = os.listdir(SONYC_PATH + OPEN_L3.format(year=args.year))
+    os.makedirs(f'nodes/{args.year}', exist_ok=True)
+
+    rainy_df = pd.read_csv('data/audio-paths-rained.csv')
+    nonrainy_df = pd.read_csv('data/audio-paths-nonrained.csv')
+
+    rainy_nodes = rainy_df['path'].map(lambda _: _.split('/')[2])
+    nonrainy_nodes = nonrainy_df['path'].map(lambda _: _.split('/')[2])
+
+    tasks = {}
+    for node_path in node_paths:
+        node = node_path.split('_')[0]
+
+        rainy_matches = rainy_df[rainy_nodes == node]['node_timestamp'].values
+        nonrainy_matches = nonrainy_df[nonrainy_nodes == node]['node_timestamp'].values
+
+        if not rainy_matches.any() or not nonrainy_matches.any():
+            print(strftime(f'[%T] No matches found for {node}'))
+            continue
+
+        tasks[node] = (node_path, rainy_matches, nonrainy_matches, args.year)
+
+    results, timings, errors = collect(run_nodes(extract_node, tasks, PROCESSES, MAX_OPEN_FILES))
+    print(strftime(f'[%T] {sum(results.values())} embeddings extracted from {len(results)} nodes'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import os
+import pickle
+
+import numpy as np
+
+from scipy.spatial.distance import cdist
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics.pairwise import euclidean_distances, manhattan_distances
+from sklearn.neighbors import KNeighborsClassifier
+
+# arrays of a fitted index, saved as .npy files by IVFKNeighborsClassifier.save
+INDEX_ARRAYS = ('centroids_', 'X_', 'y_', 'ids_', 'offsets_')
+
+
+def distances(A, B, p):
+    if p == 1:
+        return manhattan_distances(A, B)
+    if p == 2:
+        return euclidean_distances(A, B)
+    return cdist(A, B, 'minkowski', p=p)
+
+def neighbor_weights(dist, weights):
+    '''Weights of the neighbours at dist, as KNeighborsClassifier computes them.
+
+    With 'distance', a query with neighbours at distance 0 only counts
+    those. Missing neighbours (infinite distance) get weight 0.
+    '''
+    if weights == 'uniform':
+        return np.isfinite(dist).astype(np.float64)
+    with np.errstate(divide='ignore'):
+        inverse = 1 / dist
+    exact = np.isinf(inverse)
+    inverse[exact.any(axis=1)] = exact[exact.any(axis=1)]
+    return inverse
+
+
+class IVFKNeighborsClassifier(ClassifierMixin, BaseEstimator):
+    '''Approximate k-nearest-neighbours classifier over an inverted file index.
+
+    fit clusters the training rows into n_lists lists around k-means
+    centroids. A query is only compared with the rows of the n_probe lists
+    whose centroids are closest to it, so prediction costs about
+    n_probe / n_lists of the brute-force search. Raising n_probe trades
+    speed for recall, and can be changed with set_params after fitting;
+    n_probe = n_lists is an exact search. Queries whose probed lists hold
+    fewer than n_neighbors rows probe further lists until they have enough.
+
+    n_neighbors, p and weights mean what they do in KNeighborsClassifier.
+    n_lists defaults to the square root of the number of training rows.
+    '''
+    def __init__(self, n_neighbors=5, p=2, weights='uniform', n_lists=None, n_probe=8,
+                 batch_size=1024, max_train_rows=None, seed=0):
+        self.n_neighbors = n_neighbors
+        self.p = p
+        self.weights = weights
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.batch_size = batch_size
+        self.max_train_rows = max_train_rows
+        self.seed = seed
+
+    def fit(self, X, y):
+        X = np.asarray(X, dtype=np.float32)
+        self.classes_, y = np.unique(y, return_inverse=True)
+        n_lists = min(self.n_lists or int(np.sqrt(len(X))), len(X))
+
+        # the centroids are fit on a sample, the lists hold every row
+        rows = np.arange(len(X))
+        max_train_rows = self.max_train_rows or 256 * n_lists
+        if len(X) > max_train_rows:
+            rows = np.sort(np.random.RandomState(self.seed).choice(len(X), max_train_rows, replace=False))
+        kmeans = MiniBatchKMeans(n_lists, batch_size=4096, n_init=3, random_state=self.seed).fit(X[rows])
+        self.centroids_ = kmeans.cluster_centers_.astype(np.float32)
+
+        lists = np.concatenate([
+            distances(X[lo:lo + self.batch_size], self.centroids_, self.p).argmin(axis=1)
+            for lo in range(0, len(X), self.batch_size)
+        ])
+        order = np.argsort(lists, kind='stable')
+        self.X_ = X[order]
+        self.y_ = y[order]
+        self.ids_ = order
+        self.offsets_ = np.searchsorted(lists[order], np.arange(n_lists + 1))
+        self.index_path_ = None
+        return self
+
+    def _scan(self, X, queries, probes, best_d, best_i):
+        # process list by list: every query probing a list is compared with
+        # its rows at once, and its n_neighbors best candidates are kept
+        k = best_d.shape[1]
+        flat_lists = probes.ravel()
+        flat_queries = np.repeat(queries, probes.shape[1])
+        order = np.argsort(flat_lists, kind='stable')
+        lists, starts = np.unique(flat_lists[order], return_index=True)
+
+        for list_id, qs in zip(lists, np.split(flat_queries[order], starts[1:])):
+            lo, hi = self.offsets_[list_id], self.offsets_[list_id + 1]
+            if lo == hi:
+                continue
+            candidate_d = np.hstack([best_d[qs], distances(X[qs], self.X_[lo:hi], self.p)])
+            candidate_i = np.hstack([best_i[qs], np.broadcast_to(np.arange(lo, hi), (len(qs), hi - lo))])
+            top = np.argpartition(candidate_d, k - 1, axis=1)[:, :k]
+            best_d[qs] = np.take_along_axis(candidate_d, top, axis=1)
+            best_i[qs] = np.take_along_axis(candidate_i, top, axis=1)
+
+    def _search(self, X, k):
+        '''Distances and index rows of the k approximate nearest neighbours of a batch.'''
+        n_lists = len(self.centroids_)
+        probe_order = np.argsort(distances(X, self.centroids_, self.p), axis=1)
+        best_d = np.full((len(X), k), np.inf)
+        best_i = np.full((len(X), k), -1)
+
+        n_probe = min(self.n_probe, n_lists)
+        self._scan(X, np.arange(len(X)), probe_order[:, :n_probe], best_d, best_i)
+        for rank in range(n_probe, n_lists):
+            short = np.flatnonzero(np.isinf(best_d).any(axis=1))
+            if not len(short):
+                break
+            self._scan(X, short, probe_order[short, rank:rank + 1], best_d, best_i)
+
+        order = np.argsort(best_d, axis=1, kind='stable')
+        return np.take_along_axis(best_d, order, axis=1), np.take_along_axis(best_i, order, axis=1)
+
+    def _batches(self, X):
+        self._check_index()
+        X = np.asarray(X, dtype=np.float32)
+        for lo in range(0, len(X), self.batch_size):
+            yield X[lo:lo + self.batch_size]
+
+    def kneighbors(self, X, n_neighbors=None, return_distance=True):
+        '''Like KNeighborsClassifier.kneighbors; indices are rows of the training data.'''
+        k = n_neighbors or self.n_neighbors
+        results = [self._search(batch, k) for batch in self._batches(X)]
+        dist = np.vstack([d for d, _ in results])
+        ind = np.vstack([i for _, i in results])
+        ind = np.where(ind >= 0, self.ids_[np.maximum(ind, 0)], -1)
+        return (dist, ind) if return_distance else ind
+
+    def predict_proba(self, X):
+        probabilities = []
+        for batch in self._batches(X):
+            dist, ind = self._search(batch, min(self.n_neighbors, len(self.X_)))
+            weights = neighbor_weights(dist, self.weights)
+            labels = self.y_[np.maximum(ind, 0)]
+            proba = np.zeros((len(batch), len(self.classes_)))
+            for label in range(len(self.classes_)):
+                proba[:, label] = (weights * (labels == label)).sum(axis=1)
+            probabilities.append(proba / proba.sum(axis=1, keepdims=True))
+        return np.vstack(probabilities) if probabilities else np.empty((0, len(self.classes_)))
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    # persistence
+
+    def save(self, path):
+        '''Pickle the model to path and its index to the directory path + '.index/'.
+
+        The pickle only refers to the index, which is memory-mapped when the
+        model is unpickled, so pickling a saved model to worker processes
+        is cheap and the workers share one copy of the index.
+        '''
+        index_path = os.path.abspath(path) + '.index/'
+        os.makedirs(index_path, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            # np.save adds .npy to names without it, so keep the suffix on the temp file
+            np.save(index_path + f'{name}.tmp.npy', getattr(self, name))
+            os.replace(index_path + f'{name}.tmp.npy', index_path + f'{name}.npy')
+
+        self.index_path_ = index_path
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(self, f)
+        os.replace(path + '.tmp', path)
+
+    def load_index(self, index_path):
+        self.index_path_ = index_path
+        for name in INDEX_ARRAYS:
+            setattr(self, name, np.load(index_path + f'{name}.npy', mmap_mode='r'))
+        return self
+
+    def _check_index(self):
+        if not hasattr(self, 'X_'):
+            raise ValueError(f'index not found at {self.index_path_}; load the model with ann.load(path)')
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        if state.get('index_path_'):
+            state = {key: value for key, value in state.items() if key not in INDEX_ARRAYS}
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        if self.__dict__.get('index_path_') and not hasattr(self, 'X_') and os.path.isdir(self.index_path_):
+            self.load_index(self.index_path_)
+
+
+def load(path):
+    '''Unpickle a model saved to path; an IVF index is read from next to it, wherever path now is.'''
+    with open(path, 'rb') as f:
+        model = pickle.load(f)
+    if isinstance(model, IVFKNeighborsClassifier) and model.index_path_:
+        model.load_index(os.path.abspath(path) + '.index/')
+    return model
+
+def save(model, path):
+    if isinstance(model, IVFKNeighborsClassifier):
+        model.save(path)
+        return
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(model, f)
+    os.replace(path + '.tmp', path)
+
+# KNN backends with the same parameters
+backends = {
+    'exact': KNeighborsClassifier,
+    'ivf': IVFKNeighborsClassifier,
+}
+
+def knn(backend='exact', **params):
+    '''A KNN classifier from one of the backends, e.g. knn('ivf', n_neighbors=50, p=1, n_probe=16).'''
+    if backend == 'exact':
+        params = {key: value for key, value in params.items() if key in KNeighborsClassifier().get_params()}
+    return backends[backend](**params)
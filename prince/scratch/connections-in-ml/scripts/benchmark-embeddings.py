@@ -0,0 +1,74 @@
+import argparse
+import os
+import time
+
+from time import strftime
+
+import pandas as pd
+
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.svm import SVC
+
+import job_helpers
+
+BENCHMARK_PATH = '../results/embedding-benchmark.csv'
+
+# the two models whose cost grows with the embedding size
+models = {
+    'knn': lambda: KNeighborsClassifier(n_neighbors=50, p=1, weights='distance', n_jobs=-1),
+    'svm': lambda: SVC(C=10, kernel='rbf'),
+}
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--representations',
+        nargs='+',
+        default=['full', 'pca-128/float16', 'pca-128/int8'],
+        help="'full' or reduced stores written by reduce-embeddings.py, e.g. pca-128/int8"
+    )
+    parser.add_argument('--models', nargs='+', default=list(models), choices=list(models))
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    training_data, testing_data = job_helpers.get_data()
+
+    rows = []
+    for representation in args.representations:
+        start = time.time()
+        X_train, y_train = job_helpers.organize_data(training_data, job_helpers.DESIGN_MATRIX_PATH, representation)
+        X_test, y_test = job_helpers.organize_data(testing_data, job_helpers.DESIGN_MATRIX_PATH, representation)
+        load_seconds = time.time() - start
+
+        for model_name in args.models:
+            print(strftime(f'[%T] {model_name} on {representation} ({X_train.shape[1]} dimensions)'))
+            model = models[model_name]()
+
+            start = time.time()
+            model.fit(X_train, y_train)
+            fit_seconds = time.time() - start
+
+            start = time.time()
+            y_pred = model.predict(X_test)
+            predict_seconds = time.time() - start
+
+            metrics = job_helpers.get_metrics(y_test, y_pred)
+            rows.append({
+                'representation': representation,
+                'model': model_name,
+                'dimensions': X_train.shape[1],
+                'dtype': str(X_train.dtype),
+                'design_matrix_MB': (X_train.nbytes + X_test.nbytes) / 2**20,
+                'load_seconds': load_seconds,
+                'fit_seconds': fit_seconds,
+                'predict_seconds': predict_seconds,
+                'F1': metrics['F1'],
+                'Accuracy': metrics['Accuracy'],
+            })
+
+    results = pd.DataFrame(rows)
+    os.makedirs(os.path.dirname(BENCHMARK_PATH), exist_ok=True)
+    results.to_csv(BENCHMARK_PATH, index=False)
+    print(results.to_string(index=False))
@@ -0,0 +1,80 @@
+import argparse
+import os
+import time
+
+from time import strftime
+
+import numpy as np
+import pandas as pd
+
+import ann
+import job_helpers
+
+BENCHMARK_PATH = '../results/knn-benchmark.csv'
+
+# the parameters of the coarse KNN model
+PARAMS = {'n_neighbors': 50, 'p': 1, 'weights': 'distance'}
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--representation',
+        default='full',
+        help="'full' or a reduced store written by reduce-embeddings.py, e.g. pca-128/int8"
+    )
+    parser.add_argument('--n-lists', type=int, default=None, help='lists of the IVF index (default: sqrt of the training rows)')
+    parser.add_argument('--n-probes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--n-jobs', type=int, default=1, help='n_jobs of the exact KNeighborsClassifier')
+    parser.add_argument('--queries', type=int, default=None, help='test rows to query (default: all)')
+
+    return parser.parse_args()
+
+def recall(approximate, exact):
+    '''Mean fraction of the exact neighbours that the approximate search found.'''
+    return np.mean([len(np.intersect1d(a, e)) / len(e) for a, e in zip(approximate, exact)])
+
+if __name__ == '__main__':
+    args = get_args()
+    training_data, testing_data = job_helpers.get_data()
+    X_train, y_train = job_helpers.organize_data(training_data, job_helpers.DESIGN_MATRIX_PATH, args.representation)
+    X_test, y_test = job_helpers.organize_data(testing_data, job_helpers.DESIGN_MATRIX_PATH, args.representation)
+    X_test, y_test = np.asarray(X_test[:args.queries]), y_test[:args.queries]
+
+    rows = []
+    def record(backend, n_probe, model, build_seconds, neighbors):
+        start = time.time()
+        y_pred = model.predict(X_test)
+        predict_seconds = time.time() - start
+
+        print(strftime(f'[%T] {backend} n_probe={n_probe}: {len(X_test) / predict_seconds:.1f} queries per second'))
+        metrics = job_helpers.get_metrics(y_test, y_pred)
+        rows.append({
+            'backend': backend,
+            'n_probe': n_probe,
+            'build_seconds': build_seconds,
+            'predict_seconds': predict_seconds,
+            'queries_per_second': len(X_test) / predict_seconds,
+            'recall': recall(model.kneighbors(X_test, return_distance=False), neighbors),
+            'F1': metrics['F1'],
+            'Accuracy': metrics['Accuracy'],
+        })
+        return y_pred
+
+    start = time.time()
+    exact = ann.knn('exact', n_jobs=args.n_jobs, **PARAMS).fit(X_train, y_train)
+    build_seconds = time.time() - start
+    neighbors = exact.kneighbors(X_test, return_distance=False)
+    record('exact', None, exact, build_seconds, neighbors)
+
+    start = time.time()
+    model = ann.knn('ivf', n_lists=args.n_lists, **PARAMS).fit(X_train, y_train)
+    build_seconds = time.time() - start
+    print(strftime(f'[%T] built an index of {len(model.centroids_)} lists in {build_seconds:.2f} seconds'))
+    for n_probe in args.n_probes:
+        record('ivf', n_probe, model.set_params(n_probe=n_probe), build_seconds, neighbors)
+
+    results = pd.DataFrame(rows)
+    results['representation'] = args.representation
+    os.makedirs(os.path.dirname(BENCHMARK_PATH), exist_ok=True)
+    results.to_csv(BENCHMARK_PATH, index=False)
+    print(results.to_string(index=False))
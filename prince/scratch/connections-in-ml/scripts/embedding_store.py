@@ -0,0 +1,151 @@
+import json
+import os
+import pickle
+
+from time import strftime
+
+import h5py
+import numpy as np
+
+from sklearn.decomposition import IncrementalPCA
+from sklearn.random_projection import GaussianRandomProjection
+
+import job_helpers
+
+CHUNK_ROWS = 4096
+CLASSES = ('rainy', 'nonrainy')
+
+
+def node_names():
+    return sorted(name[:28] for name in os.listdir(job_helpers.EMBEDDINGS_PATH))
+
+def iter_blocks(node, chunk_rows=CHUNK_ROWS):
+    '''Yield (class, timestamps, flattened float32 vectors) for a node, chunk_rows at a time.'''
+    with h5py.File(job_helpers.embedding_path(node), 'r') as node_f:
+        for label in CLASSES:
+            dataset = node_f[label]
+            for lo in range(0, len(dataset), chunk_rows):
+                block = dataset[lo:lo + chunk_rows]
+                yield label, block['timestamp'], block['openl3'].reshape(len(block), -1).astype(np.float32)
+
+def fit_reducer(method='pca', n_components=128, chunk_rows=CHUNK_ROWS, seed=job_helpers.SEED):
+    '''Fit an IncrementalPCA or a Gaussian random projection over every node's embeddings.
+
+    The vectors are streamed chunk by chunk, so memory use does not grow
+    with the number of nodes. IncrementalPCA needs at least n_components
+    rows per update; smaller leftovers are carried over into the next one.
+    '''
+    if method == 'random':
+        _, _, vectors = next(iter_blocks(node_names()[0], chunk_rows))
+        return GaussianRandomProjection(n_components, random_state=seed).fit(vectors)
+    if method != 'pca':
+        raise ValueError(f'unknown reduction {method}')
+
+    reducer = IncrementalPCA(n_components)
+    pending = []
+    for node in node_names():
+        print(strftime(f'[%T] fitting {method} on {node}'))
+        for _, _, vectors in iter_blocks(node, chunk_rows):
+            pending.append(vectors)
+            if sum(len(block) for block in pending) >= max(chunk_rows, n_components):
+                reducer.partial_fit(np.concatenate(pending))
+                pending = []
+    if pending and sum(len(block) for block in pending) >= n_components:
+        reducer.partial_fit(np.concatenate(pending))
+    return reducer
+
+def reduced_dtype(n_components, precision):
+    return np.dtype([('timestamp', 'f8'), ('openl3', precision, (n_components,))])
+
+def write_store(reducer, name, chunk_rows=CHUNK_ROWS):
+    '''Write every node's reduced vectors as float16 under REDUCED_PATH/name/.
+
+    The files have the layout of the extracted embeddings ('rainy' and
+    'nonrainy' datasets with 'timestamp' and 'openl3' fields, in the same
+    row order), so job_helpers reads them like the full ones.
+    '''
+    path = job_helpers.REDUCED_PATH + f'{name}/'
+    os.makedirs(path, exist_ok=True)
+    dtype = reduced_dtype(reducer.n_components, 'f2')
+
+    for node in node_names():
+        output_path = path + f'{node}-float16.h5'
+        if os.path.exists(output_path):
+            continue
+        print(strftime(f'[%T] reducing {node}'))
+
+        with h5py.File(job_helpers.embedding_path(node), 'r') as node_f:
+            sizes = {label: len(node_f[label]) for label in CLASSES}
+
+        with h5py.File(output_path + '.partial', 'w') as out_f:
+            datasets = {label: out_f.create_dataset(label, shape=(size,), dtype=dtype) for label, size in sizes.items()}
+            written = dict.fromkeys(CLASSES, 0)
+            for label, timestamps, vectors in iter_blocks(node, chunk_rows):
+                rows = np.empty(len(timestamps), dtype=dtype)
+                rows['timestamp'] = timestamps
+                rows['openl3'] = reducer.transform(vectors)
+                datasets[label][written[label]:written[label] + len(rows)] = rows
+                written[label] += len(rows)
+        os.replace(output_path + '.partial', output_path)
+
+def quantize_store(name):
+    '''Write int8 copies of the float16 store REDUCED_PATH/name/.
+
+    Each component is scaled by its largest absolute value over all nodes;
+    the scale is saved as the 'scale' attribute of every dataset, and
+    job_helpers.read_embeddings multiplies it back in.
+    '''
+    path = job_helpers.REDUCED_PATH + f'{name}/'
+    nodes = node_names()
+
+    absmax = None
+    for node in nodes:
+        with h5py.File(path + f'{node}-float16.h5', 'r') as node_f:
+            for label in CLASSES:
+                vectors = node_f[label].fields('openl3')[:]
+                if len(vectors):
+                    node_max = np.abs(vectors.astype(np.float32)).max(axis=0)
+                    absmax = node_max if absmax is None else np.maximum(absmax, node_max)
+    scale = np.where(absmax > 0, absmax / 127, 1).astype(np.float32)
+
+    for node in nodes:
+        output_path = path + f'{node}-int8.h5'
+        with h5py.File(path + f'{node}-float16.h5', 'r') as node_f, h5py.File(output_path + '.partial', 'w') as out_f:
+            for label in CLASSES:
+                data = node_f[label][:]
+                rows = np.empty(len(data), dtype=reduced_dtype(len(scale), 'i1'))
+                rows['timestamp'] = data['timestamp']
+                rows['openl3'] = np.clip(np.rint(data['openl3'].astype(np.float32) / scale), -127, 127)
+                out_f.create_dataset(label, data=rows).attrs['scale'] = scale
+        os.replace(output_path + '.partial', output_path)
+
+def build(method='pca', n_components=128, precisions=('float16', 'int8'), chunk_rows=CHUNK_ROWS):
+    '''Fit a reducer and write the reduced stores; returns the store name, e.g. pca-128.
+
+    Delete REDUCED_PATH/<name>/ to refit from scratch.
+    '''
+    name = f'{method}-{n_components}'
+    path = job_helpers.REDUCED_PATH + f'{name}/'
+    os.makedirs(path, exist_ok=True)
+
+    # a rerun after preemption keeps the fitted reducer, so the nodes already
+    # written stay consistent with the rest
+    if os.path.exists(path + 'reducer.pkl'):
+        with open(path + 'reducer.pkl', 'rb') as f:
+            reducer = pickle.load(f)
+    else:
+        reducer = fit_reducer(method, n_components, chunk_rows)
+        with open(path + 'reducer.pkl.partial', 'wb') as f:
+            pickle.dump(reducer, f)
+        os.replace(path + 'reducer.pkl.partial', path + 'reducer.pkl')
+
+    write_store(reducer, name, chunk_rows)
+    if 'int8' in precisions:
+        quantize_store(name)
+
+    meta = {'method': method, 'n_components': n_components, 'precisions': list(precisions)}
+    if method == 'pca':
+        meta['explained_variance_ratio'] = float(reducer.explained_variance_ratio_.sum())
+    with open(path + 'meta.json', 'w') as f:
+        json.dump(meta, f, indent=1)
+    return name
@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import time
+
+from concurrent import futures
+from time import strftime
+
+import numpy as np
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.neural_network import MLPClassifier
+from sklearn.svm import SVC
+
+import ann
+import job_helpers
+
+SAVED_MODELS_PATH = '../saved-models/'
+RESULTS_PATH = '../results/'
+CPUS = int(os.environ.get('SLURM_CPUS_PER_TASK', os.cpu_count()))
+
+# model name -> (estimator class, parameters found by the validation notebooks)
+models = {
+    'coarse-knn': (KNeighborsClassifier, {'n_neighbors': 50, 'p': 1, 'weights': 'distance', 'algorithm': 'auto'}),
+    # the same KNN over an approximate index (see ann.py and benchmark-knn.py)
+    'coarse-ann': (ann.IVFKNeighborsClassifier, {'n_neighbors': 50, 'p': 1, 'weights': 'distance', 'n_probe': 8}),
+    'coarse-nn': (MLPClassifier, {
+        'activation': 'relu',
+        'alpha': 0.001,
+        'hidden_layer_sizes': (32, 64),
+        'learning_rate_init': 0.001,
+        'solver': 'adam'
+    }),
+    'coarse-rf': (RandomForestClassifier, {'max_depth': 64, 'min_samples_split': 32, 'n_estimators': 200}),
+    'coarse-svm': (SVC, {'C': 10, 'kernel': 'rbf'}),
+}
+
+_data = None
+
+
+def _init_worker(X_train_path, y_train, X_test_path, y_test):
+    # the design matrices are memory-mapped from the cache written by the
+    # parent, so every worker shares one copy instead of reading the embeddings
+    global _data
+    _data = (np.load(X_train_path, mmap_mode='r'), y_train, np.load(X_test_path, mmap_mode='r'), y_test)
+
+def train(model_name, n_jobs):
+    '''Fit, evaluate and save one model; returns its results.'''
+    X_train, y_train, X_test, y_test = _data
+    estimator, params = models[model_name]
+    model = estimator(**params)
+    if 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=n_jobs)
+
+    print(strftime(f'[%T] begin training {model_name}'))
+    start = time.time()
+    model.fit(X_train, y_train)
+    fit_seconds = time.time() - start
+    print(strftime(f'[%T] done training {model_name} in {fit_seconds:.2f} seconds'))
+
+    start = time.time()
+    y_pred = model.predict(X_test)
+    predict_seconds = time.time() - start
+
+    print(strftime(f'[%T] {model_name} metrics:'))
+    metrics = job_helpers.get_metrics(y_test, y_pred)
+
+    ann.save(model, SAVED_MODELS_PATH + f'{model_name}.model')
+
+    return {
+        'model': model_name,
+        'params': {key: list(value) if isinstance(value, tuple) else value for key, value in params.items()},
+        'n_jobs': n_jobs,
+        'dimensions': X_train.shape[1],
+        'F1': float(metrics['F1']),
+        'Accuracy': float(metrics['Accuracy']),
+        'Confusion Matrix': [int(count) for count in metrics['Confusion Matrix']],
+        'fit_seconds': fit_seconds,
+        'predict_seconds': predict_seconds,
+        'train_rows': len(y_train),
+        'test_rows': len(y_test),
+    }
+
+def save_results(results):
+    os.makedirs(RESULTS_PATH, exist_ok=True)
+    results['finished'] = strftime('%Y-%m-%dT%H:%M:%S')
+    path = RESULTS_PATH + f"{results['model']}.json"
+    with open(path + '.tmp', 'w') as f:
+        json.dump(results, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--models',
+        nargs='+',
+        default=list(models),
+        choices=list(models),
+        help='models to train (default: all)'
+    )
+    parser.add_argument('--processes', type=int, default=None, help='models trained at the same time (default: all of them)')
+    parser.add_argument(
+        '--n-jobs',
+        type=int,
+        default=None,
+        help='n_jobs of each model that supports it (default: the CPUs split over --processes)'
+    )
+    parser.add_argument(
+        '--representation',
+        default='full',
+        help="embeddings to train on: 'full' or a reduced store such as pca-128/int8 (see reduce-embeddings.py)"
+    )
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    processes = args.processes or len(args.models)
+    n_jobs = args.n_jobs or max(1, CPUS // processes)
+
+    # load the design matrices once for all models
+    training_data, testing_data = job_helpers.get_data()
+    X_train, y_train = job_helpers.organize_data(training_data, job_helpers.DESIGN_MATRIX_PATH, args.representation)
+    X_test, y_test = job_helpers.organize_data(testing_data, job_helpers.DESIGN_MATRIX_PATH, args.representation)
+
+    os.makedirs(SAVED_MODELS_PATH, exist_ok=True)
+    with futures.ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_worker,
+        initargs=(X_train.filename, y_train, X_test.filename, y_test)
+    ) as executor:
+        pending = {executor.submit(train, model_name, n_jobs): model_name for model_name in args.models}
+        for future in futures.as_completed(pending):
+            try:
+                results = future.result()
+            except Exception as error:
+                print(strftime(f'[%T] {pending[future]} failed: {error!r}'))
+                continue
+            save_results(results)
+            print(strftime(f"[%T] {results['model']} saved, fit in {results['fit_seconds']:.2f} seconds"))
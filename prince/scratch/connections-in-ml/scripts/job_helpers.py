@@ -1,3 +1,4 @@
+import hashlib
 import os
 
 from time import strftime
@@ -11,6 +12,8 @@ from sklearn.metrics import accuracy_score, confusion_matrix, f1_score
 SEED = 2660280232880537243 % 2**32
 
 EMBEDDINGS_PATH = '../data/embeddings/'
+DESIGN_MATRIX_PATH = '../data/design-matrices/'
+REDUCED_PATH = '../data/reduced-embeddings/'
 
 # data preprocessing functions
 def extract_index(node):
@@ -31,27 +34,132 @@ def merge_indices():
     indices = [extract_index(node) for node in map(lambda _: _[:28], os.listdir(EMBEDDINGS_PATH))]
     return pd.concat(indices).reset_index(drop=True).rename(columns={'index': 'embedding_index'})
 
-def organize_data(input_df):
-    index_df = merge_indices()
-    merged_df = pd.merge(index_df, input_df, how='inner', on=['node_timestamp', 'class', 'node'])
-    
-    nodes = iter(merged_df['node'].drop_duplicates())
-    X = []
-    y = []
-    for node in nodes:
-        file_path = EMBEDDINGS_PATH + f'{node}-features.h5'
-        embedding_indices = merged_df[merged_df['node'] == node][['embedding_index', 'class']]
-        
-        with h5py.File(file_path, 'r') as node_f:
-            for (_, info) in embedding_indices.iterrows():
-                if info['class']:
-                    new_vec = node_f['rainy'][info['embedding_index']]['openl3']
-                else:
-                    new_vec = node_f['nonrainy'][info['embedding_index']]['openl3']
-                X.append(new_vec.reshape(-1))
-                y.append(info['class'])
-                
-    return np.stack(X), np.array(y)
+_index_df = None
+
+def get_index():
+    '''merge_indices(), read once per process.'''
+    global _index_df
+    if _index_df is None:
+        _index_df = merge_indices()
+    return _index_df
+
+def embedding_path(node, representation='full'):
+    '''Path of a node's embeddings: the extracted OpenL3 vectors for 'full', or a
+    reduced store such as 'pca-128/float16' written by reduce-embeddings.py.'''
+    if representation == 'full':
+        return EMBEDDINGS_PATH + f'{node}-features.h5'
+    reduction, precision = representation.split('/')
+    return REDUCED_PATH + f'{reduction}/{node}-{precision}.h5'
+
+def embedding_size(node, representation='full'):
+    with h5py.File(embedding_path(node, representation), 'r') as node_f:
+        return int(np.prod(node_f['rainy'].dtype['openl3'].shape))
+
+# rows read at once by read_embeddings, and the gap between wanted rows
+# that is still read through rather than split into two reads
+CHUNK_ROWS = 256
+MAX_GAP = 16
+
+def row_runs(indices, chunk_rows=CHUNK_ROWS, max_gap=MAX_GAP):
+    '''Split sorted unique row indices into (start, stop) slices of at most chunk_rows rows.
+
+    Indices less than max_gap apart share a slice; any longer gap starts a
+    new one, so a slice never reads many rows that are not wanted.
+    '''
+    breaks = np.flatnonzero(np.diff(indices) > max_gap + 1) + 1
+    runs = []
+    for run in np.split(indices, breaks):
+        for lo in range(run[0], run[-1] + 1, chunk_rows):
+            runs.append((lo, min(lo + chunk_rows, run[-1] + 1)))
+    return runs
+
+def matrix_dtype(representation='full'):
+    '''dtype of organize_data's X: float32 for the full vectors, float16 for reduced stores.
+
+    int8 stores are scaled back into float16, which keeps their precision.
+    '''
+    return np.float32 if representation == 'full' else np.float16
+
+def read_embeddings(dataset, embedding_indices):
+    '''Read the flattened openl3 vectors at embedding_indices.
+
+    Only the wanted rows are read, in short slices (see row_runs). int8
+    stores are scaled back to float with the dataset's 'scale' attribute.
+    '''
+    unique_indices, inverse = np.unique(embedding_indices, return_inverse=True)
+    field = dataset.fields('openl3')
+    blocks = []
+    for lo, hi in row_runs(unique_indices):
+        wanted = unique_indices[np.searchsorted(unique_indices, lo):np.searchsorted(unique_indices, hi)]
+        if len(wanted):
+            blocks.append(field[lo:hi][wanted - lo])
+    vectors = np.concatenate(blocks).reshape(len(unique_indices), -1)[inverse]
+    if 'scale' in dataset.attrs:
+        vectors = vectors * dataset.attrs['scale'].astype(np.float32)
+    return vectors
+
+def design_matrix_key(input_df, representation='full'):
+    '''Hash of the requested samples and of the embedding files they come from.'''
+    digest = hashlib.sha1()
+    if representation != 'full':
+        digest.update(f'{representation}:{np.dtype(matrix_dtype(representation))}'.encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(
+        input_df[['node_timestamp', 'class', 'node']], index=False
+    ).values.tobytes())
+    directory = os.path.dirname(embedding_path('', representation)) + '/'
+    for name in sorted(os.listdir(directory)):
+        stat = os.stat(directory + name)
+        digest.update(f'{name}:{stat.st_mtime_ns}:{stat.st_size}'.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def organize_data(input_df, cache_dir=None, representation='full'):
+    '''Return (X, y) for the samples in input_df.
+
+    All rows a node needs from one class are read at once and written into a
+    preallocated matrix of matrix_dtype(representation). Rows come out grouped by node in order of
+    first appearance, as before. With cache_dir, X and y are saved there as
+    .npy files keyed by design_matrix_key and returned memory-mapped; later
+    calls with the same samples skip the HDF5 reads entirely. representation
+    picks the full vectors or a reduced store (see embedding_path).
+    '''
+    if cache_dir is not None:
+        key = design_matrix_key(input_df, representation)
+        X_path = os.path.join(cache_dir, f'X-{key}.npy')
+        y_path = os.path.join(cache_dir, f'y-{key}.npy')
+        if os.path.exists(X_path) and os.path.exists(y_path):
+            print(strftime(f'[%T] Loading cached design matrix {key}'))
+            return np.load(X_path, mmap_mode='r'), np.load(y_path)
+
+    merged_df = pd.merge(get_index(), input_df, how='inner', on=['node_timestamp', 'class', 'node'])
+
+    # group rows by node, keeping the nodes' order of first appearance
+    order = np.argsort(pd.factorize(merged_df['node'])[0], kind='stable')
+    merged_df = merged_df.iloc[order].reset_index(drop=True)
+
+    y = merged_df['class'].to_numpy()
+    if merged_df.empty:
+        return np.empty((0, 0), dtype=matrix_dtype(representation)), y
+
+    X = np.empty(
+        (len(merged_df), embedding_size(merged_df['node'].iat[0], representation)),
+        dtype=matrix_dtype(representation)
+    )
+
+    for (node, label), rows in merged_df.groupby(['node', 'class'], sort=False).indices.items():
+        with h5py.File(embedding_path(node, representation), 'r') as node_f:
+            dataset = node_f['rainy'] if label else node_f['nonrainy']
+            X[rows] = read_embeddings(dataset, merged_df['embedding_index'].to_numpy()[rows])
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # np.save adds .npy to names without it, so keep the suffix on the temp file
+        np.save(X_path + '.tmp.npy', X)
+        np.save(y_path + '.tmp.npy', y)
+        os.replace(X_path + '.tmp.npy', X_path)
+        os.replace(y_path + '.tmp.npy', y_path)
+        return np.load(X_path, mmap_mode='r'), y
+
+    return X, y
 
 def get_data():
     training_data = pd.read_csv(
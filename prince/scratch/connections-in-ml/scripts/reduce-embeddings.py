@@ -0,0 +1,19 @@
+import argparse
+
+from time import strftime
+
+import embedding_store
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--method', default='pca', choices=['pca', 'random'])
+    parser.add_argument('--components', type=int, default=128)
+    parser.add_argument('--precisions', nargs='+', default=['float16', 'int8'], choices=['float16', 'int8'])
+    parser.add_argument('--chunk-rows', type=int, default=embedding_store.CHUNK_ROWS)
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = get_args()
+    name = embedding_store.build(args.method, args.components, args.precisions, args.chunk_rows)
+    print(strftime(f'[%T] reduced embeddings written to {embedding_store.job_helpers.REDUCED_PATH}{name}/'))
@@ -1,108 +1,130 @@
+import argparse
+import os
 import random
+import sys
 import time
 
 from concurrent import futures
 
-import h5py
-import numpy as np
 import pandas as pd
 
+sys.path.append('/'.join(os.getcwd().split('/')[:-1]) + '/library')
+from index_cache import load_index
+from ingest import read_weather
+from labels import dry_day
+from matching import build_instance_df, match_closest_instances, write_instance_df
+from nodes import INDEX_DIR, read_nodes, select_nodes
+
 random.seed(5176679560041666191) # I hashed 'hedgehog' and this number came up
 
 def convert_to_epoch(stamp):
     return (stamp - pd.Timestamp('1970-01-01')) // pd.Timedelta('1s')
 
-def read_index_file(node):
+def read_index_file(node, year):
     start_t = time.time()
-    index_path = f'../sonyc/indices/2017/{node}_recording_index.h5'
-    f = h5py.File(index_path, 'r')['recording_index']['timestamp', 'day_hdf5_path', 'day_h5_index']
+    index_path = INDEX_DIR.format(year=year) + f'{node}_recording_index.h5'
+    f = load_index(index_path)
     end_t = time.time()
     delta_t = end_t - start_t
     print(f'{delta_t:>6.2f} seconds taken to load {node}')
     return node, f
 
-def get_argmin(node_timestamps, rain_timestamp):
-    '''Return index of closest occurence of sound recording.'''
-    return np.argmin(abs(node_timestamps - rain_timestamp))
-
-def match_closest_instances(node_indices, rain_df):
-    return {
-        node: tuple(
-            (get_argmin(indices['timestamp'], rain_ts), i) for i, rain_ts in rain_df['datetime[epoch]'].iteritems()
-        ) for node, indices in node_indices.items()
-    }
-
-def create_df(node_indices, rain_df, closest_instances):
-    skeleton = []
-    for node, indices in node_indices.items():
-        instance_indices = closest_instances[node] # (node_indices index, rain_df index) tuple
-        for node_index, rain_index in instance_indices:
-            node_ts, path, index = indices[node_index]
-            _, rain_ts, precip = rain_df.iloc[rain_index]
-            skeleton.append((node_ts, rain_ts, node_ts-rain_ts, precip, path.decode('utf-8'), index))
-            
-    return pd.DataFrame(
-        skeleton,
-        columns=['node_timestamp', 'rain_timestamp', 'diff', 'precipitation[mm]', 'path', 'index']
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--extra-formats',
+        nargs='*',
+        default=[],
+        choices=['parquet', 'feather'],
+        help='also write the table in these columnar formats next to the csv'
+    )
+    parser.add_argument(
+        '--weather-store',
+        default=None,
+        help='read weather from this partitioned Parquet store instead of ../data/weather-hourly.csv'
+    )
+    parser.add_argument('--station', default='LGA', help='station to read from --weather-store')
+    parser.add_argument('--year', type=int, default=2017, help='match the weather of this year with its recording indices')
+    parser.add_argument('--nodes', nargs='+', default=None, help='only match these nodes (default: every available node)')
+    parser.add_argument('--output', default='../data/audio-paths-nonrained.csv')
+    parser.add_argument(
+        '--min-index-bytes',
+        type=int,
+        default=2**20,
+        help='skip nodes whose recording index is smaller than this'
+    )
+    parser.add_argument('--min-recordings', type=int, default=0, help='skip nodes with fewer recordings')
+    parser.add_argument(
+        '--min-coverage',
+        type=float,
+        default=0.0,
+        help='skip nodes that recorded on less than this fraction of the days of the year'
     )
 
+    return parser.parse_args()
+
 def main():
-    # load weather data
-    weather_df = pd.read_csv(
-        '../data/weather-hourly.csv', 
-        usecols=['datetime[utc]', 'precipitation[mm]'], 
-        parse_dates=['datetime[utc]']
-    )
-    weather_df['datetime[epoch]'] = weather_df['datetime[utc]'].map(convert_to_epoch)
-    weather_df['bool'] = weather_df['precipitation[mm]'] == 0
+    args = get_args()
 
-    norain_dates = weather_df.groupby(weather_df['datetime[utc]'].apply(lambda _: _.date()))['bool'].apply(all)
-    # get only True values
-    norain_dates = norain_dates[norain_dates]
+    year_start = pd.Timestamp(f'{args.year}-01-01')
+    year_end = pd.Timestamp(f'{args.year + 1}-01-01')
 
-    condition_nonrainy = weather_df['datetime[utc]'].apply(lambda _: _.date() in set(norain_dates.index))
-    condition_2017 = weather_df['datetime[epoch]'] < convert_to_epoch(pd.Timestamp('2018-01-01'))
+    # load weather data
+    if args.weather_store is None:
+        weather_df = pd.read_csv(
+            '../data/weather-hourly.csv', 
+            usecols=['datetime[utc]', 'precipitation[mm]'], 
+            parse_dates=['datetime[utc]']
+        )
+    else:
+        weather_df = read_weather(
+            args.weather_store,
+            args.station,
+            start=year_start,
+            end=year_end,
+            columns=['datetime[utc]', 'precipitation[mm]']
+        )
+    weather_df['datetime[epoch]'] = convert_to_epoch(weather_df['datetime[utc]'])
+
+    condition_nonrainy = dry_day(weather_df)
+    condition_year = (
+        (weather_df['datetime[epoch]'] >= convert_to_epoch(year_start))
+        & (weather_df['datetime[epoch]'] < convert_to_epoch(year_end))
+    )
 
     # int(len(pd.read_csv('../data/audio-paths-rained.csv')) / 24) == 1191
     N = 1300    
-    reduced_weather_df = (weather_df[condition_nonrainy & condition_2017]
+    reduced_weather_df = (weather_df[condition_nonrainy & condition_year]
         .sample(N, random_state=517667956)
         .reset_index(drop=True))
     reduced_weather_df = reduced_weather_df[['datetime[utc]', 'datetime[epoch]', 'precipitation[mm]']]
         
-    with open('../data/nodes.txt', 'r') as f:
-        lines = f.readlines()
-        nodes = set(l.strip().split(' ')[0] for l in lines)
-
-    # nodes unavailable in 2017
-    unavailable_nodes = {
-        'sonycnode-b827eb18a94a.sonyc', 'sonycnode-b827eb3bda47.sonyc', 'sonycnode-b827eb3e842e.sonyc',
-        'sonycnode-b827eb5a9021.sonyc', 'sonycnode-b827eb5d1714.sonyc', 'sonycnode-b827eb6e8929.sonyc',
-        'sonycnode-b827eb74a519.sonyc', 'sonycnode-b827eb74a9e8.sonyc', 'sonycnode-b827eb7b2c3e.sonyc',
-        'sonycnode-b827eb84deb5.sonyc', 'sonycnode-b827eb8e1f0b.sonyc', 'sonycnode-b827eb8e32ad.sonyc',
-        'sonycnode-b827eb977bfb.sonyc', 'sonycnode-b827ebafe148.sonyc', 'sonycnode-b827ebed47a6.sonyc',
-    }
+    # nodes listed in nodes.txt that have an index for the year of at least --min-index-bytes
+    nodes = set(read_nodes()['name'])
+    available_nodes = nodes.intersection(select_nodes(
+        args.year,
+        min_bytes=args.min_index_bytes,
+        min_recordings=args.min_recordings,
+        min_coverage=args.min_coverage
+    ))
+    if args.nodes is not None:
+        available_nodes &= set(args.nodes)
+    print(f'{len(available_nodes)} of {len(nodes)} nodes available')
 
-    # any node smaller than 1MB
-    small_nodes = {
-        'sonycnode-b827eb241343.sonyc', 'sonycnode-b827eb329ab8.sonyc', 'sonycnode-b827eb32e075.sonyc',
-        'sonycnode-b827eb429cd4.sonyc', 'sonycnode-b827eb43d8f4.sonyc', 'sonycnode-b827eb73e772.sonyc',
-        'sonycnode-b827eb820cfe.sonyc', 'sonycnode-b827eb8e2420.sonyc', 'sonycnode-b827eb9b859c.sonyc',
-        'sonycnode-b827eb9bed23.sonyc', 'sonycnode-b827eb9d0e7f.sonyc', 'sonycnode-b827ebdd5c38.sonyc',
-        'sonycnode-b827ebe1fe4b.sonyc', 'sonycnode-b827ebf9d204.sonyc', 'sonycnode-b827ebfd616c.sonyc',
-    }
-
-    available_nodes = nodes - unavailable_nodes - small_nodes
-    
     read_start = time.time()
     with futures.ThreadPoolExecutor(max_workers=24) as executor:
-        node_indices = dict(executor.map(read_index_file, available_nodes))
+        node_indices = dict(executor.map(read_index_file, available_nodes, [args.year] * len(available_nodes)))
     print(f'Total time elapsed: {time.time() - read_start:.2f} seconds')
     
-    closest_instances = match_closest_instances(node_indices, reduced_weather_df)
-
-    print('Saving to ../data/audio-paths-nonrained.csv')
-    create_df(node_indices, reduced_weather_df, closest_instances).to_csv('../data/audio-paths-nonrained.csv', index=False)
+    closest_instances = match_closest_instances(node_indices, reduced_weather_df['datetime[epoch]'].values)
+
+    print(f'Saving to {args.output}')
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    write_instance_df(
+        build_instance_df(node_indices, reduced_weather_df, closest_instances),
+        args.output,
+        args.extra_formats
+    )
     
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,45 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append('/'.join(os.getcwd().split('/')[:-1]) + '/library')
+from hourly import aggregate, write_cube
+from nodes import select_nodes
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--feature-sets',
+        nargs='+',
+        default=['spl', 'coarse', 'fine'],
+        choices=['spl', 'coarse', 'fine'],
+        help='feature sets to aggregate (default: all)'
+    )
+    parser.add_argument('--year', type=int, default=2017)
+    parser.add_argument('--output', default='../data/hourly-{feature_set}-{year}.npz')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--max-open-files', type=int, default=None)
+
+    return parser.parse_args()
+
+
+def main():
+    start = time.time()
+    args = get_args()
+
+    nodes = select_nodes(args.year)
+    for feature_set in args.feature_sets:
+        cube = aggregate(feature_set, nodes, args.year, processes=args.processes, max_open_files=args.max_open_files)
+
+        output = args.output.format(feature_set=feature_set, year=args.year)
+        write_cube(output, cube)
+        print(f"Saved {len(cube['nodes'])} nodes x {len(cube['hours'])} hours x {len(cube['features'])} features to {output}")
+
+    end = time.time()
+    print(f'This script took {end - start:.2f} seconds to complete')
+
+
+if __name__ == '__main__':
+    main()
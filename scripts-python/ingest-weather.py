@@ -0,0 +1,38 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append('/'.join(os.getcwd().split('/')[:-1]) + '/library')
+from ingest import CHUNKSIZE, DEFAULT_STRATEGY, ingest
+from weather import strategies
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data_locs', nargs='+', help='raw Mesonet CSV files, one or more per station')
+    parser.add_argument('--store', default='../data/weather-store', help='partitioned Parquet output directory')
+    parser.add_argument(
+        '--strategy',
+        default=DEFAULT_STRATEGY,
+        choices=strategies,
+        help="how to fill missing ('M') precipitation values"
+    )
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    parser.add_argument('--processes', type=int, default=None)
+
+    return parser.parse_args()
+
+
+def main():
+    start = time.time()
+    args = get_args()
+
+    ingest(args.data_locs, args.store, args.strategy, args.chunksize, args.processes)
+
+    end = time.time()
+    print(f'This script took {end - start:.2f} seconds to complete')
+
+
+if __name__ == '__main__':
+    main()
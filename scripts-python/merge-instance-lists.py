@@ -0,0 +1,43 @@
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append('/'.join(os.getcwd().split('/')[:-1]) + '/library')
+from matching import write_instance_df
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('parts', nargs='+', help='instance lists written with --nodes, e.g. by run-pipeline.py')
+    parser.add_argument('--output', required=True, help='e.g. ../data/audio-paths-rained.csv')
+    parser.add_argument(
+        '--extra-formats',
+        nargs='+',
+        default=[],
+        choices=['parquet', 'feather'],
+        help='also write the table in these columnar formats next to the csv'
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    start = time.time()
+    args = get_args()
+
+    # parts of nodes that were filtered out only hold the header
+    frames = [pd.read_csv(part) for part in args.parts]
+    df = pd.concat([frame for frame in frames if len(frame)] or frames[:1], ignore_index=True)
+
+    print(f'Saving {len(df)} rows of {len(args.parts)} parts to {args.output}')
+    write_instance_df(df, args.output, args.extra_formats)
+
+    end = time.time()
+    print(f'This script took {end - start:.2f} seconds to complete')
+
+
+if __name__ == '__main__':
+    main()
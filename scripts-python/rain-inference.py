@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.append('/'.join(os.getcwd().split('/')[:-1]) + '/library')
+from inference import CHUNK_BYTES, infer, model_columns, with_locations
+from nodes import NODES_PATH, read_nodes, select_nodes
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model', help='pickled model, e.g. ../saved-models/coarse-rf.model')
+    parser.add_argument(
+        '--feature-set',
+        default='openl3',
+        choices=list(model_columns),
+        help='features the model was trained on (default: openl3, like the saved-models/*.model files)'
+    )
+    parser.add_argument('--start', default='2017-01-01', help='UTC start of the range')
+    parser.add_argument('--end', default='2018-01-01', help='UTC end of the range (exclusive)')
+    parser.add_argument('--nodes', nargs='+', default=None, help='nodes to score (default: every node with an index)')
+    parser.add_argument(
+        '--reducer',
+        default=None,
+        help='reducer.pkl of the reduced embeddings an openl3 model was trained on (see reduce-embeddings.py)'
+    )
+    parser.add_argument('--output', default='../data/rain-probability-{feature_set}-{start}-{end}.csv')
+    parser.add_argument(
+        '--chunk-mb',
+        type=int,
+        default=CHUNK_BYTES // 2**20,
+        help='megabytes of features read and predicted at once per node'
+    )
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--max-open-files', type=int, default=None)
+
+    return parser.parse_args()
+
+
+def main():
+    start = time.time()
+    args = get_args()
+
+    nodes = args.nodes
+    if nodes is None:
+        years = range(pd.Timestamp(args.start).year, (pd.Timestamp(args.end) - pd.Timedelta('1s')).year + 1)
+        nodes = sorted({node for year in years for node in select_nodes(year, start=args.start, end=args.end)})
+
+    frame = infer(
+        nodes,
+        args.model,
+        args.feature_set,
+        args.start,
+        args.end,
+        reducer_path=args.reducer,
+        chunk_bytes=args.chunk_mb * 2**20,
+        processes=args.processes,
+        max_open_files=args.max_open_files
+    )
+    if os.path.exists(NODES_PATH):
+        frame = with_locations(frame, read_nodes())
+
+    output = args.output.format(feature_set=args.feature_set, start=args.start, end=args.end)
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    if output.endswith('.parquet'):
+        frame.to_parquet(output + '.tmp', index=False)
+    else:
+        frame.to_csv(output + '.tmp', index=False)
+    os.replace(output + '.tmp', output)
+    print(f"Saved {len(frame)} hours of {frame['node'].nunique()} nodes to {output}")
+
+    end = time.time()
+    print(f'This script took {end - start:.2f} seconds to complete')
+
+
+if __name__ == '__main__':
+    main()
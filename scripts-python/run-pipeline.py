@@ -0,0 +1,169 @@
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.append('/'.join(os.getcwd().split('/')[:-1]) + '/library')
+from ingest import part_pattern
+from nodes import INDEX_DIR
+from pipeline import Pipeline, STATE_PATH, Task
+
+PYTHON = 'python'
+SCRIPTS = '../scripts-python/'
+LIBRARY = '../library/'
+NOTEBOOKS = '../notebooks/'
+BUILD = '../build/notebooks/'
+WEATHER_STORE = '../data/weather-store'
+STATION = 'LGA'
+# the instance lists match this year's weather with its recording indices
+YEAR = 2017
+INSTANCE_PARTS = '../data/instances/{kind}/{node}.csv'
+
+
+def execute_notebook(name):
+    # the executed copy goes to BUILD, so the tracked notebook (an input of
+    # its own stage) is not rewritten by the run
+    return ['jupyter', 'nbconvert', '--to', 'notebook', '--execute', '--output-dir', BUILD, NOTEBOOKS + name]
+
+def raw_weather_files():
+    # station files dropped into ../data/raw/, or the single documented file
+    return sorted(glob.glob('../data/raw/*.csv')) or ['../data/weather-hourly-raw.csv']
+
+def ingest_partitions():
+    # one partition per raw station file, so adding or changing one file
+    # only re-ingests that file
+    return {
+        os.path.basename(path): (
+            [PYTHON, SCRIPTS + 'ingest-weather.py', path],
+            [path, SCRIPTS + 'ingest-weather.py', LIBRARY + 'ingest.py', LIBRARY + 'weather.py'],
+            [part_pattern(WEATHER_STORE, os.path.splitext(os.path.basename(path))[0])],
+        )
+        for path in raw_weather_files()
+    }
+
+def index_files():
+    return {
+        os.path.basename(path).split('_')[0]: path
+        for path in sorted(glob.glob(INDEX_DIR.format(year=YEAR) + '*_recording_index.h5'))
+    }
+
+def instance_parts(kind):
+    return [INSTANCE_PARTS.format(kind=kind, node=node) for node in index_files()]
+
+def instance_partitions(script, kind):
+    # one partition per recording index, so a new or updated index only
+    # rematches its node. Every node reads the year's LGA partitions of the
+    # weather store, so weather outside the year does not rerun anything.
+    # Nodes that are filtered out (nodes.txt, --min-* options) get a part
+    # with only the header.
+    def partitions():
+        return {
+            node: (
+                [
+                    PYTHON, SCRIPTS + script, '--weather-store', WEATHER_STORE, '--station', STATION,
+                    '--year', str(YEAR), '--nodes', node, '--output', INSTANCE_PARTS.format(kind=kind, node=node),
+                ],
+                [
+                    f'{WEATHER_STORE}/station={STATION}/year={YEAR}/*.parquet',
+                    '../data/nodes.txt',
+                    path,
+                    SCRIPTS + script,
+                    LIBRARY + 'ingest.py',
+                    LIBRARY + 'labels.py',
+                    LIBRARY + 'matching.py',
+                    LIBRARY + 'index_cache.py',
+                    LIBRARY + 'nodes.py',
+                ],
+                [INSTANCE_PARTS.format(kind=kind, node=node)],
+            )
+            for node, path in index_files().items()
+        }
+    return partitions
+
+def instance_lists(name, script, kind):
+    # the per-node parts, and the merged list the notebooks read
+    output = f'../data/audio-paths-{kind}.csv'
+    return [
+        Task(f'{name}-by-node', partitions=instance_partitions(script, kind), requires=['ingest-weather']),
+        Task(
+            name,
+            command=[PYTHON, SCRIPTS + 'merge-instance-lists.py', *instance_parts(kind), '--output', output],
+            inputs=[*instance_parts(kind), SCRIPTS + 'merge-instance-lists.py', LIBRARY + 'matching.py'],
+            outputs=[output],
+        ),
+    ]
+
+def extraction_inputs(notebook):
+    return [
+        '../data/audio-paths-rained.csv',
+        '../data/audio-paths-nonrained.csv',
+        NOTEBOOKS + notebook,
+        LIBRARY + 'features.py',
+        LIBRARY + 'alignment.py',
+        LIBRARY + 'sampling.py',
+        LIBRARY + 'runner.py',
+        LIBRARY + 'index_cache.py',
+        LIBRARY + 'matching.py',
+    ]
+
+stages = [
+    Task('ingest-weather', partitions=ingest_partitions),
+    Task(
+        'clean-weather',
+        command=[PYTHON, SCRIPTS + 'weather-hourly-cleaner.py', '../data/weather-hourly-raw.csv', '../data/weather-hourly.csv'],
+        inputs=['../data/weather-hourly-raw.csv', SCRIPTS + 'weather-hourly-cleaner.py', LIBRARY + 'weather.py'],
+        outputs=['../data/weather-hourly.csv'],
+    ),
+    *instance_lists('rainy-instances', 'create-rainy-instance-list.py', 'rained'),
+    *instance_lists('nonrainy-instances', 'create-nonrainy-instance-list.py', 'nonrained'),
+    Task(
+        'spl-data',
+        command=execute_notebook('get_spl_data.ipynb'),
+        inputs=extraction_inputs('get_spl_data.ipynb'),
+        outputs=['../data/spl-train.csv', '../data/spl-test.csv', BUILD + 'get_spl_data.ipynb'],
+    ),
+    Task(
+        'class-prediction-data',
+        command=execute_notebook('get_class_prediction_data.ipynb'),
+        inputs=extraction_inputs('get_class_prediction_data.ipynb'),
+        outputs=[
+            f'../data/predictions-{granularity}-{split}.csv'
+            for granularity in ('coarse', 'fine') for split in ('train', 'test')
+        ],
+    ),
+]
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stages', nargs='*', help='stages to bring up to date, with their upstream stages (default: all)')
+    parser.add_argument('--force', action='store_true', help='rerun the stages even if they are up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only print what would run')
+    parser.add_argument('--list', action='store_true', help='list the stages and whether they are stale')
+    parser.add_argument('--state', default=STATE_PATH)
+
+    return parser.parse_args()
+
+
+def main():
+    start = time.time()
+    args = get_args()
+
+    pipeline = Pipeline(stages, args.state)
+
+    if args.list:
+        for name in pipeline.order(args.stages):
+            stale = pipeline.stale(name)
+            total = len(pipeline.task_partitions(name))
+            print(f'{name:<28} {len(stale)} of {total} partitions stale')
+        return
+
+    pipeline.run(args.stages, force=args.force, dry_run=args.dry_run)
+
+    end = time.time()
+    print(f'This script took {end - start:.2f} seconds to complete')
+
+
+if __name__ == '__main__':
+    main()
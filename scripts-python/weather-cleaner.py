@@ -1,66 +1,29 @@
 import argparse
+import os
 import pandas as pd
-import statistics
+import sys
 import time
 
+sys.path.append('/'.join(os.getcwd().split('/')[:-1]) + '/library')
+from weather import clean_precip_col, strategies
+
+DEFAULT_STRATEGY = 'midpoint'
+
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('data_loc')
     parser.add_argument('target_loc')
+    parser.add_argument(
+        '--strategy',
+        default=DEFAULT_STRATEGY,
+        choices=strategies,
+        help="how to fill missing ('M') precipitation values"
+    )
 
     return parser.parse_args()
 
 
-def clean_precip_col(df):
-    precip_col = df['p01m']
-
-    # Replace trace values, T, with 0.00 in 'p01m' column
-    precip_t_count = precip_col[precip_col == 'T'].count()
-    if precip_t_count > 0:
-        print(f"{precip_t_count} trace values in 'p01m' column")
-        df.replace({'p01m': {'T': 0.00}}, inplace=True)
-
-    precip_instances = precip_col[precip_col != 'M'].index
-    if precip_instances[0] != 0:
-        df.loc[0:precip_instances[0], 'p01m'] = precip_col[precip_instances[0]]
-
-    # possibly improvement: rather than abrupt change, linearly extrapolate
-    for i in range(len(precip_instances)-1):
-        beg = precip_instances[i]+1
-        end = precip_instances[i+1]
-
-        init_val = float(precip_col.at[beg-1])
-        final_val = float(precip_col.at[end])
-
-        if init_val == final_val:
-            # if initial and final value same, just replace M with either
-            df.loc[beg:end, 'p01m'] = init_val
-        else:
-            total_interval = end - beg
-
-            if total_interval == 0:
-                continue
-
-            if total_interval % 2 == 0:
-                mid = beg + total_interval/2
-                df.loc[beg:mid, 'p01m'] = init_val
-                df.loc[mid:end, 'p01m'] = final_val
-            else:
-                mid = statistics.median(range(beg, end))
-                mid_val = statistics.median([init_val, final_val])
-                df.loc[mid, 'p01m'] = mid_val
-                if total_interval > 1:
-                    df.loc[beg:mid, 'p01m'] = init_val
-                    df.loc[mid+1:end, 'p01m'] = final_val
-
-    # Take care of remaining missing values, if any
-    last_index = precip_instances[-1]
-    if last_index < len(precip_col):
-        last_val = float(precip_col.at[last_index])
-        df.loc[last_index+1:, 'p01m'] = last_val
-
-
 def change_col_names(df):
     df.rename(
         columns={
@@ -78,7 +41,7 @@ def main():
 
     df = pd.read_csv(args.data_loc, parse_dates=['valid'])
 
-    clean_precip_col(df)
+    clean_precip_col(df, args.strategy)
     change_col_names(df)
 
     df.to_csv(args.target_loc, index=False)
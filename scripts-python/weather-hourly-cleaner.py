@@ -1,32 +1,29 @@
 import argparse
+import os
 import pandas as pd
+import sys
 import time
 
+sys.path.append('/'.join(os.getcwd().split('/')[:-1]) + '/library')
+from weather import clean_precip_col, strategies
+
+DEFAULT_STRATEGY = 'zero'
+
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('data_loc')
     parser.add_argument('target_loc')
+    parser.add_argument(
+        '--strategy',
+        default=DEFAULT_STRATEGY,
+        choices=strategies,
+        help="how to fill missing ('M') precipitation values"
+    )
 
     return parser.parse_args()
 
 
-def clean_precip_col(df):
-    precip_col = df['p01m']
-
-    # Replace trace values, T, with 0.00
-    precip_t_count = precip_col[precip_col == 'T'].count()
-    if precip_t_count > 0:
-        print(f"{precip_t_count} trace values in 'p01m' column")
-        df.replace({'p01m': {'T': 0.00}}, inplace=True)
-
-    # Replace missing values, M, with 0.00
-    precip_m_count = precip_col[precip_col == 'M'].count()
-    if precip_m_count > 0:
-        print(f"{precip_m_count} missing values in 'p01m' column")
-        df.replace({'p01m': {'M': 0.00}}, inplace=True)
-
-
 def change_col_names(df):
     df.rename(
         columns={
@@ -44,7 +41,7 @@ def main():
 
     df = pd.read_csv(args.data_loc, parse_dates=['valid'])
 
-    clean_precip_col(df)
+    clean_precip_col(df, args.strategy)
     change_col_names(df)
 
     df.to_csv(args.target_loc, index=False)